@@ -5,6 +5,7 @@ from time import mktime
 from pathlib import Path
 from typing import List, Dict
 from defi_assessment.modelling import contract, finance
+from defi_assessment.schema import OVERVIEW_SCHEMA, read_dataset
 from math import sqrt
 
 COLUMNS = [
@@ -101,7 +102,8 @@ def get_table_data(src: Path, ref: Path, ctx_mpath: Path) -> List[Dict]:
 
     ref : Path
         path of the referenced csv file which provide detailed data of smart
-        contract code commit
+        contract code commit. Parquet or Feather files of the same name are
+        read too
 
     ctx_mpath : Path
         path of the contract model
@@ -112,7 +114,7 @@ def get_table_data(src: Path, ref: Path, ctx_mpath: Path) -> List[Dict]:
         [{name, contract-score, finance-score, centralization-score}]
     """
     df = pd.read_csv(src)
-    ref_df = pd.read_csv(ref)
+    ref_df = read_dataset(ref, OVERVIEW_SCHEMA)
     data = []
     fin_scores = finance.get_finance_scores()
     for _, row in df.iterrows():
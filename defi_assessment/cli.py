@@ -2,7 +2,10 @@ import click
 from pathlib import Path
 from defi_assessment.data_collection.contract import create_contract_datasets
 from defi_assessment.data_collection.finance import create_finance_datasets
-from defi_assessment.preprocess.contract import pre_process
+from defi_assessment.git_tool.backend import BACKENDS
+from defi_assessment.git_tool.gitcmd import DiffLimits
+from defi_assessment.preprocess.contract import process_overview
+from defi_assessment.schema import FORMATS, dataset_path
 from defi_assessment.modelling import contract
 from defi_assessment import __version__
 
@@ -26,7 +29,41 @@ def cli():
 @click.option('-t', '--target', type=click.Path(),
               default=Path.cwd() / 'data/',
               help='Target directory to put collected data')
-def data_collection(inc, contract, finance, source, target):
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of platforms collected at the same time.')
+@click.option('-w', '--workers', type=click.IntRange(min=1), default=1,
+              help='Number of fix commits blamed, and of processes '
+                   'computing the git matrix, at the same time for each '
+                   'platform.')
+@click.option('--cache', type=click.Path(file_okay=False), default=None,
+              help='Keep git repos in this directory and only fetch new '
+                   'objects on later runs.')
+@click.option('--partial', is_flag=True,
+              help='Clone git repos without file contents, which are '
+                   'fetched on demand.')
+@click.option('--git-backend', type=click.Choice(list(BACKENDS)),
+              default='subprocess', show_default=True,
+              help='How diffs and files are read from git repos. pygit2 '
+                   'reads them in-process and needs the pygit2 package.')
+@click.option('--profile', type=click.Path(dir_okay=False), default=None,
+              help='Write calls, time and output size of git commands per '
+                   'platform and feature to this .json or .csv file.')
+@click.option('--max-diff-bytes', type=click.IntRange(min=1), default=None,
+              help='Leave files with larger patches out of commit changes.')
+@click.option('--max-diff-lines', type=click.IntRange(min=0), default=None,
+              help='Leave files with more changed lines out of commit '
+                   'changes.')
+@click.option('--diff-exclude', multiple=True, metavar='PATTERN',
+              help='Leave files matching this glob pattern, e.g. "*.json", '
+                   'or in this directory out of commit changes. Can be '
+                   'given many times.')
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)),
+              default='csv', show_default=True,
+              help='Format of the fix commit and matrix datasets. parquet '
+                   'and feather need the pyarrow package.')
+def data_collection(inc, contract, finance, source, target, jobs, workers,
+                    cache, partial, git_backend, profile, max_diff_bytes,
+                    max_diff_lines, diff_exclude, fmt):
     """Collect raw data.
 
     Collect data for smart contract risks and financial risks. Three folders
@@ -36,28 +73,45 @@ def data_collection(inc, contract, finance, source, target):
     target = Path(target)
     if contract:
         tgt_folder = target/'contract'
-        create_contract_datasets(source, tgt_folder, inc)
+        limits = DiffLimits(max_diff_bytes, max_diff_lines, diff_exclude)
+        create_contract_datasets(source, tgt_folder, inc, jobs,
+                                 cache and Path(cache), partial, git_backend,
+                                 profile and Path(profile), limits, workers,
+                                 fmt)
     if finance:
         create_finance_datasets(target, inc)
 
 
 @click.command()
 @click.option('-f', '--force', is_flag=True,
-              help='Force to reproduce processed data')
+              help='Force to reproduce processed data of all platforms, '
+                   'not only of the ones whose files changed.')
 @click.option('-s', '--source', type=click.Path(exists=True),
               default=Path.cwd() / 'data/contract',
               help='Directory of collected data')
 @click.option('-t', '--target', type=click.Path(),
               default=(Path.cwd() / 'data/contract/contract_overview.csv'),
               help='Location to put newly created csv file.')
-def data_process(force, source, target):
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)),
+              default=None,
+              help='Format of the created file. By default it is told by the '
+                   'suffix of the target.')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of processes cleaning commit changes.')
+@click.option('-k', '--keyword', 'keywords', multiple=True, metavar='WORD',
+              help='Add a column counting this word in commit changes, '
+                   'e.g. "delegatecall" gives "ndelegatecall". Can be given '
+                   'many times.')
+def data_process(force, source, target, fmt, jobs, keywords):
     """Process the data related to smart contracts.
+
+    Only the platforms whose collected files changed since the last run are
+    processed again, and only their new commits are cleaned.
     """
     target = Path(target)
-    if target.exists() and not force:
-        return
-    df = pre_process(source)
-    df.to_csv(target, index=False)
+    if fmt is not None:
+        target = dataset_path(target, fmt)
+    process_overview(Path(source), target, jobs, keywords, force)
 
 
 @click.command()
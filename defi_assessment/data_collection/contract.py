@@ -1,17 +1,55 @@
+import os
 import sys
+import atexit
+import gzip
+import json
+import multiprocessing
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from typing import Iterator
 from functools import reduce
+from contextvars import ContextVar
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
+from queue import Queue
 from tqdm.auto import tqdm
 from loguru import logger
-from defi_assessment.git_tool.gitcmd import GitCommit
+from defi_assessment.git_tool.gitcmd import GitCommit, DiffLimits
+from defi_assessment.git_tool.index import CommitIndex
 from defi_assessment.git_tool.parser import get_subsys, get_dir
+from defi_assessment.schema import (FORMATS, MATRIX_SCHEMA, FIX_COMMIT_SCHEMA,
+                                    read_dataset, write_dataset,
+                                    convert_dataset)
 
 fmt = ('<green>{time:YYYY-MM-DD HH:mm:ss}</green> | {level} | '
-       '<lvl>{message}</lvl>')
+       '<cyan>{extra[plat]}</cyan> | <lvl>{message}</lvl>')
 logger.remove()
+logger.configure(extra={'plat': '-'})
 logger.add(sys.stdout, format=fmt)
 
+# rows of a matrix csv computed between two checkpoints
+CHECKPOINT_ROWS = 500
+# commits sent to a matrix worker process at a time
+MATRIX_CHUNK = 20
+
+# (platform, progress bar position) of the platform being collected
+_platform = ContextVar('platform', default=(None, None))
+
+
+def _progress(iterable) -> tqdm:
+    """ Create a progress bar for the platform being collected
+    """
+    plat, pos = _platform.get()
+    return tqdm(iterable, position=pos, leave=pos is None)
+
+
+def _describe(tbar: tqdm, desc: str):
+    """ Set description of a progress bar, prefixed by the platform name
+    """
+    plat, _ = _platform.get()
+    tbar.set_description(desc if plat is None else f'[{plat}] {desc}')
+
 
 def _do_all_data_exist(paths: list) -> bool:
     """ Chekc if all csv files are existing
@@ -25,194 +63,737 @@ def _do_all_data_exist(paths: list) -> bool:
     return reduce(lambda x, y: x & y.exists(), paths, True)
 
 
-def _get_all_simple_commits(gc: GitCommit):
+def _get_all_simple_commits(gc: GitCommit, commits: set = None):
     """Get all commits except merge and initial commits
+
+    Args:
+        gc (GitCommit): git commit class
+        commits (set, optional): only keep these commits. Defaults to None.
     """
     all_commits = gc.get_commits()
-    merge_commits = gc.get_commits('merge')
+    if commits is not None:
+        all_commits = [c for c in all_commits if c in commits]
+    _, merge_commits = gc.classify_commits()
     # remove merge commits which contain too many changes
-    all_commits = set(all_commits) - set(merge_commits)
-    return [c for c in all_commits if not gc.is_in_1st_commits(c)]
+    merge_commits = set(merge_commits)
+    return [c for c in dict.fromkeys(all_commits)
+            if c not in merge_commits and not gc.is_in_1st_commits(c)]
+
+
+def _checkpoint_path(tgt_csv: Path) -> Path:
+    return tgt_csv.with_name(f'{tgt_csv.stem}.ckpt.jsonl')
+
+
+def _load_checkpoint(ckpt: Path) -> dict:
+    """ Read the rows saved by an interrupted run.
+
+    Args:
+        ckpt (Path): checkpoint file, one json row per line
+
+    Returns:
+        dict: {commit: row}
+    """
+    rows = {}
+    if not ckpt.exists():
+        return rows
+    with open(ckpt, encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # last line of a run killed while writing
+                break
+            rows[row['commit']] = row
+    return rows
+
+
+def _json_value(field: str, value):
+    """ Convert a value of a checkpoint row to a json value.
+
+    Args:
+        field (str): name of the field holding the value
+        value: value, maybe in a list or a dict
+
+    Raises:
+        TypeError: if the value cannot be saved as json
+
+    Returns:
+        value of a json type
+    """
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_json_value(field, x) for x in value]
+    if isinstance(value, dict):
+        return {k: _json_value(k, x) for k, x in value.items()}
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Field {field} of a checkpoint row is of type '
+                    f'{type(value).__name__}, which cannot be saved as json')
+
+
+def _save_checkpoint(ckpt: Path, rows: list):
+    """ Append rows to the checkpoint file and flush them to disk.
+    """
+    lines = ''.join(json.dumps(_json_value('row', row)) + '\n'
+                    for row in rows)
+    with open(ckpt, 'a', encoding='utf-8') as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _blame_fix_commit(gc: GitCommit, fc: str) -> list:
+    """ Find the commits which introduced the lines changed by a fix commit.
+
+    Returns:
+        list: [fname, changed lines, bug commits] of every blamed file
+    """
+    files = gc.get_changed_filenames(fc)
+    fname_lines = gc.get_changed_lines(fc, files)
+    bug_commits = gc.blame_old_lines(fc, fname_lines)
+    return [[fname, fname_lines[fname], commits]
+            for fname, commits in bug_commits.items()]
 
 
-def create_fix_commit_csv(gc: GitCommit, csv: Path):
+def create_fix_commit_csv(gc: GitCommit,
+                          csv: Path,
+                          commits: set = None,
+                          workers: int = 1):
     """ Create datastes for commits releated to bug fix.
 
+    Rows are written as fix commits are blamed. The rows of every fix
+    commit are also saved to a checkpoint file next to the csv, so a run
+    which is interrupted skips the fix commits blamed before.
+
     Args:
         gc (GitCommit): git commit class
-        csv (Path): file to save the result data
+        csv (Path): file to save the result data, a csv, parquet or
+                    feather file
+        commits (set, optional): only blame the fix commits among these and
+                                 append them to the existing file. Defaults
+                                 to None, blame all fix commits.
+        workers (int, optional): number of fix commits blamed at the same
+                                 time. Defaults to 1.
     """
-    data = {
-        'fix_commit': [],
-        'fname': [],
-        'changed_lines': [],
-        'bug_commits': []
-    }
-
     fix_commits = gc.get_fix_commits()
-    tbar = tqdm(fix_commits)
-    for fc in tbar:
-        tbar.set_description(f'Fetching bug fix data for {fc}')
-        files = gc.get_changed_filenames(fc)
-        fname_lines = gc.get_changed_lines(fc, files)
-        bug_commits = gc.blame_old_lines(fc, fname_lines)
-        for fname, commits in bug_commits.items():
-            data['fix_commit'].append(fc)
-            data['fname'].append(fname)
-            data['changed_lines'].append(fname_lines[fname])
-            data['bug_commits'].append(commits)
-
-    df = pd.DataFrame(data)
-    df.to_csv(csv, index=False)
+    append = commits is not None and csv.exists()
+    if commits is not None:
+        done = set()
+        if append:
+            done = set(read_dataset(csv, FIX_COMMIT_SCHEMA,
+                                    ['fix_commit'])['fix_commit'])
+        fix_commits = [c for c in fix_commits
+                       if c in commits and c not in done]
+        logger.info(f'Found {len(fix_commits)} new fix commits.')
+
+    ckpt = _checkpoint_path(csv)
+    done = _load_checkpoint(ckpt)
+    if done:
+        logger.info(f'Resume from {len(done)} fix commits saved in {ckpt}')
+    todo = [fc for fc in fix_commits if fc not in done]
+
+    # rows are streamed to a csv file, then moved to `csv`
+    tmp_csv = csv.with_name(f'{csv.stem}.rows.csv')
+    columns = list(FIX_COMMIT_SCHEMA)
+    columnar = csv.suffix != '.csv'
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool, \
+            open(tmp_csv, 'w', encoding='utf-8', newline='') as f:
+        futures = iter([pool.submit(_blame_fix_commit, gc, fc)
+                        for fc in todo])
+        pd.DataFrame(columns=columns).to_csv(
+            f, header=columnar or not append, index=False)
+        try:
+            tbar = _progress(fix_commits)
+            for fc in tbar:
+                _describe(tbar, f'Fetching bug fix data for {fc}')
+                if fc in done:
+                    # json turns the (start, n_lines) tuples into lists
+                    files = [
+                        [fname, [[tuple(c) for c in item] for item in lines],
+                         bug_commits]
+                        for fname, lines, bug_commits in done[fc]['files']
+                    ]
+                else:
+                    files = next(futures).result()
+                    _save_checkpoint(ckpt, [{'commit': fc, 'files': files}])
+                rows = [[fc, *file] for file in files]
+                pd.DataFrame(rows, columns=columns).to_csv(f, header=False,
+                                                           index=False)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    if columnar:
+        df = read_dataset(tmp_csv, FIX_COMMIT_SCHEMA)
+        if append:
+            df = pd.concat([read_dataset(csv, FIX_COMMIT_SCHEMA), df],
+                           ignore_index=True)
+        write_dataset(df, csv, FIX_COMMIT_SCHEMA)
+        tmp_csv.unlink()
+    elif append:
+        with open(tmp_csv, encoding='utf-8') as src, \
+                open(csv, 'a', encoding='utf-8', newline='') as dst:
+            dst.write(src.read())
+        tmp_csv.unlink()
+    else:
+        os.replace(tmp_csv, csv)
+    ckpt.unlink(missing_ok=True)
 
 
 def get_buggy_commits_from_fix_csv(csv: Path) -> list:
     """Get buggy commits from xxxx_fix_commit.csv
 
     Args:
-        csv (Path): path of the csv file
+        csv (Path): path of the csv, parquet or feather file
 
     Returns:
         list: list of buggy commits
     """
-    buggy_strs = pd.read_csv(csv, index_col=False)['bug_commits']\
-                   .to_list()
+    buggy_lists = read_dataset(csv, FIX_COMMIT_SCHEMA,
+                               ['bug_commits'])['bug_commits']
     buggy_commits = set()
-    for commits in buggy_strs:
-        commits = GitCommit.standardize_commit_id(commits.split(','))
+    for commits in buggy_lists:
+        commits = GitCommit.standardize_commit_id(commits)
         buggy_commits.update(commits)
 
     return list(buggy_commits)
 
 
-def create_bug_commit_json(gc: GitCommit, src_csv: Path, tgt_json: Path):
-    all_commits = _get_all_simple_commits(gc)
-    bug_commits = get_buggy_commits_from_fix_csv(src_csv)
+def create_bug_commit_json(gc: GitCommit,
+                           src_csv: Path,
+                           tgt_json: Path,
+                           commits: set = None):
+    """ Create datasets of the messages and changes of commits.
+
+    Rows are written one by one as gzipped JSON lines, see
+    `read_bug_commit_json`, so memory use does not grow with the number
+    of commits.
+
+    Args:
+        gc (GitCommit): git commit class
+        src_csv (Path): fix commit csv file
+        tgt_json (Path): file to save the result data
+        commits (set, optional): only add these commits to the existing
+                                 file, whose `buggy` labels are updated.
+                                 Defaults to None, add all commits.
+    """
+    all_commits = _get_all_simple_commits(gc, commits)
+    bug_commits = set(get_buggy_commits_from_fix_csv(src_csv))
 
     logger.info(f'Number of total commits: {len(all_commits)}')
     logger.info(f'Number of buggy commits: {len(bug_commits)}')
 
-    data = {
-        'commit': [],
-        'msg': [],
-        'changes': [],
-        'buggy': []
-    }
+    tmp_json = tgt_json.with_name(f'{tgt_json.name}.tmp')
+    with gzip.open(tmp_json, 'wt', encoding='utf-8') as f:
+        if commits is not None and tgt_json.exists():
+            new = set(all_commits)
+            for row in read_bug_commit_json(tgt_json):
+                if row['commit'] not in new:
+                    row['buggy'] = row['commit'] in bug_commits
+                    f.write(json.dumps(row) + '\n')
+
+        tbar = _progress(all_commits)
+        for commit in tbar:
+            _describe(tbar, f'Fetching detailed info for {commit}')
+            row = {
+                'commit': commit,
+                'msg': gc.get_msg(commit),
+                'changes': gc.get_diff(commit),
+                'buggy': commit in bug_commits
+            }
+            f.write(json.dumps(row) + '\n')
+    os.replace(tmp_json, tgt_json)
+
+
+def read_bug_commit_json(path: Path) -> Iterator[dict]:
+    """ Iterate the rows of a file created by `create_bug_commit_json`.
 
-    tbar = tqdm(all_commits)
-    for commit in tbar:
-        tbar.set_description(f'Fetching detailed info for {commit}')
-        data['commit'].append(commit)
-        data['msg'].append(gc.get_msg(commit))
-        data['changes'].append(gc.get_diff(commit))
-        data['buggy'].append(commit in bug_commits)
+    Args:
+        path (Path): `<plat>_buggy_commits.jsonl.gz` file
 
-    df = pd.DataFrame(data)
-    df.to_json(tgt_json, orient='table')
+    Yields:
+        dict: {commit, msg, changes, buggy}
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def convert_bug_commit_json(src_json: Path, tgt_json: Path):
+    """ Convert a buggy commit file of earlier versions, a single
+    `orient='table'` json document, into gzipped json lines.
 
+    Args:
+        src_json (Path): `<plat>_buggy_commits.json` file
+        tgt_json (Path): `<plat>_buggy_commits.jsonl.gz` file
+    """
+    df = pd.read_json(src_json, orient='table')
+    tmp_json = tgt_json.with_name(f'{tgt_json.name}.tmp')
+    with gzip.open(tmp_json, 'wt', encoding='utf-8') as f:
+        for row in df[['commit', 'msg', 'changes', 'buggy']].itertuples(
+                index=False):
+            f.write(json.dumps({
+                'commit': row.commit,
+                'msg': row.msg,
+                'changes': row.changes,
+                'buggy': bool(row.buggy)
+            }) + '\n')
+    os.replace(tmp_json, tgt_json)
+    src_json.unlink()
+
+
+def _matrix_row(gc: GitCommit, commit: str, row: dict, fix_commits: set,
+                bug_commits: set) -> dict:
+    """ Compute the metrics of a commit missing from its row.
+    """
+    row['commit'] = commit if not row.get('commit') else row['commit']
+    if not row.get('la') or not row.get('ld'):
+        la, ld = gc.get_numstat(commit)
+        row['la'] = la
+        row['ld'] = ld
+    if not row.get('ns') or not row.get('nd') or not row.get('nf'):
+        fnames = gc.get_changed_filenames(commit)
+        if not row.get('ns'):
+            row['ns'] = len(get_subsys(fnames))
+        if not row.get('nd'):
+            row['nd'] = len(get_dir(fnames))
+        if not row.get('nf'):
+            row['nf'] = len(fnames)
+    if not row.get('nuc') or not row.get('ndev'):
+        hset, anset = gc.get_former_commits(commit)
+        row['nuc'] = len(hset)
+        row['ndev'] = len(anset)
+    if not row.get('inter'):
+        row['inter'] = gc.get_aver_interval(commit)
+    if not row.get('ent'):
+        row['ent'] = gc.get_entropy(commit)
+    if not row.get('exp'):
+        row['exp'] = len(gc.get_author_exp(commit))
+    if not row.get('rexp'):
+        row['rexp'] = gc.get_author_recent_exp(commit)
+    if not row.get('sexp'):
+        row['sexp'] = gc.get_author_subssys_exp(commit)
+    if not row.get('pod'):
+        row['pod'] = gc.get_author_proportion(commit)
+    if not row.get('fix'):
+        row['fix'] = commit in fix_commits
+    if not row.get('buggy'):
+        row['buggy'] = commit in bug_commits
+    if not row.get('time'):
+        row['time'] = gc.get_author_time(commit)
+
+    return row
+
+
+# (GitCommit, fix commits, buggy commits) of a matrix worker process
+_worker = None
+
+
+def _init_matrix_worker(url: str, path: str, indexed: bool, backend: str,
+                        profile: bool, diff_limits: DiffLimits,
+                        index: CommitIndex, fix_commits: set,
+                        bug_commits: set):
+    global _worker
+    gc = GitCommit(url, indexed=indexed, backend=backend, profile=profile,
+                   diff_limits=diff_limits, path=path,
+                   index=index).__enter__()
+    # workers are not left through a `with` block, so close the cat-file
+    # processes and the repo handle when the worker exits
+    atexit.register(gc.__exit__, None, None, None)
+    _worker = (gc, fix_commits, bug_commits)
+
+
+def _matrix_rows(tasks: list) -> tuple:
+    """ Compute matrix rows in a worker process.
 
-def create_git_matrix_csv(gc: GitCommit, src_csv: Path, tgt_csv: Path):
+    Args:
+        tasks (list): (commit, existing row) pairs
+
+    Returns:
+        tuple: (rows, records of `Profiler.rows` or None)
+    """
+    gc, fix_commits, bug_commits = _worker
+    rows = [_matrix_row(gc, commit, row, fix_commits, bug_commits)
+            for commit, row in tasks]
+    records = None
+    if gc.profiler is not None:
+        records = gc.profiler.rows()
+        gc.profiler.clear()
+    return rows, records
+
+
+def _parallel_matrix_rows(gc: GitCommit, commits: list, existing: dict,
+                          fix_commits: set, bug_commits: set,
+                          workers: int) -> Iterator[dict]:
+    """ Compute matrix rows in a pool of processes, each with its own
+    `GitCommit` on the clone of `gc`. The commit index of `gc` is sent to
+    the workers instead of being built again by each of them.
+
+    Commits are sent in chunks of MATRIX_CHUNK and rows are yielded in the
+    order of `commits`.
+    """
+    init = (gc.url, gc.path, gc.indexed, gc.backend.name,
+            gc.profiler is not None, gc.diff_limits, gc.index, fix_commits,
+            bug_commits)
+    tasks = [(commit, dict(existing.get(commit, {}))) for commit in commits]
+    # fork is unsafe while other platforms are collected in threads
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=ctx,
+                             initializer=_init_matrix_worker,
+                             initargs=init) as pool:
+        futures = [pool.submit(_matrix_rows, tasks[i:i + MATRIX_CHUNK])
+                   for i in range(0, len(tasks), MATRIX_CHUNK)]
+        try:
+            for future in futures:
+                rows, records = future.result()
+                if records:
+                    gc.profiler.merge(records)
+                yield from rows
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def create_git_matrix_csv(gc: GitCommit,
+                          src_csv: Path,
+                          tgt_csv: Path,
+                          checkpoint: int = CHECKPOINT_ROWS,
+                          commits: set = None,
+                          workers: int = 1):
+    """ Create the matrix of metrics of every commit.
+
+    Rows of an existing csv file are reused and only their missing metrics
+    are computed. New rows are saved to a checkpoint file next to the csv
+    every `checkpoint` rows, so a run which is interrupted resumes from
+    there.
+
+    Args:
+        gc (GitCommit): git commit class
+        src_csv (Path): fix commit csv file
+        tgt_csv (Path): file to save the result data
+        checkpoint (int, optional): number of rows between checkpoints.
+                                    Defaults to CHECKPOINT_ROWS.
+        commits (set, optional): only compute the rows of these commits.
+                                 Other existing rows are kept with their
+                                 `buggy` labels updated. Defaults to None,
+                                 all commits.
+        workers (int, optional): number of processes computing the rows.
+                                 Defaults to 1, compute them in this
+                                 process.
+    """
+    existing = {}
     if tgt_csv.exists():
         logger.info(f'Incremental sync of {tgt_csv}')
-        data = pd.read_csv(tgt_csv)
+        data = read_dataset(tgt_csv, MATRIX_SCHEMA)
+        for row in data.to_dict(orient='records'):
+            existing.setdefault(row['commit'], row)
+    ckpt = _checkpoint_path(tgt_csv)
+    done = _load_checkpoint(ckpt)
+    if done:
+        logger.info(f'Resume from {len(done)} rows saved in {ckpt}')
+
+    all_commits = _get_all_simple_commits(gc, commits)
+    fix_commits = set(gc.get_fix_commits())
+    bug_commits = set(get_buggy_commits_from_fix_csv(src_csv))
+
+    todo = [commit for commit in all_commits if commit not in done]
+    if workers > 1 and len(todo) > MATRIX_CHUNK:
+        computed = _parallel_matrix_rows(gc, todo, existing, fix_commits,
+                                         bug_commits, workers)
     else:
-        data = pd.DataFrame(columns=['commit', 'la', 'ld', 'ns', 'nd', 'nf',
-                                     'ent', 'nuc', 'ndev', 'inter', 'exp',
-                                     'rexp', 'sexp', 'pod', 'fix', 'buggy',
-                                     'time'])
+        computed = (_matrix_row(gc, commit, dict(existing.get(commit, {})),
+                                fix_commits, bug_commits)
+                    for commit in todo)
 
-    all_commits = _get_all_simple_commits(gc)
-    fix_commits = gc.get_fix_commits()
-    bug_commits = get_buggy_commits_from_fix_csv(src_csv)
-
-    tbar = tqdm(all_commits)
-    rows = []
+    tbar = _progress(all_commits)
+    rows, pending = [], []
     for commit in tbar:
-        tbar.set_description(f'Create matrix for {commit}')
-        row = data.query(f'commit == "{commit}"').to_dict(orient='records')
-        if len(row) == 0:
-            row = {}
+        _describe(tbar, f'Create matrix for {commit}')
+        if commit in done:
+            rows.append(done[commit])
+            continue
+        row = next(computed)
+        rows.append(row)
+        pending.append(row)
+        if len(pending) >= checkpoint:
+            _save_checkpoint(ckpt, pending)
+            pending = []
+
+    if commits is not None:
+        new = set(all_commits)
+        rows = [dict(row, buggy=commit in bug_commits)
+                for commit, row in existing.items()
+                if commit not in new] + rows
+
+    write_dataset(pd.DataFrame(rows), tgt_csv, MATRIX_SCHEMA)
+    ckpt.unlink(missing_ok=True)
+
+
+def create_platform_datasets(plat: str,
+                             git_addr: str,
+                             saved_dir: Path,
+                             inc: bool,
+                             cache_dir: Path = None,
+                             partial: bool = False,
+                             backend: str = 'subprocess',
+                             profile: bool = False,
+                             diff_limits: DiffLimits = None,
+                             workers: int = 1,
+                             fmt: str = 'csv') -> list:
+    """ Create csv datasets for the smart contracts of a single platform.
+
+    Args:
+        plat (str): name of the platform
+        git_addr (str): address of the git repo
+        saved_dir (Path): where to put newly created csv files
+        inc (bool): run in incremental mode
+        cache_dir (Path, optional): directory of cached git repos. Defaults
+                                    to None, clone into a temporary folder.
+        partial (bool, optional): clone without file contents. Defaults to
+                                  False.
+        backend (str, optional): git backend reading diffs and files.
+                                 Defaults to 'subprocess'.
+        profile (bool, optional): profile git commands. Defaults to False.
+        diff_limits (DiffLimits, optional): files left out of the changes
+                                            of commits. Defaults to None.
+        workers (int, optional): number of fix commits blamed, and of
+                                 processes computing the git matrix, at
+                                 the same time. Defaults to 1.
+        fmt (str, optional): format of the fix commit and matrix datasets,
+                             'csv', 'parquet' or 'feather'. Defaults to
+                             'csv'.
+
+    Returns:
+        list: records of `Profiler.rows` if profiled, None otherwise.
+    """
+    plat_dir = saved_dir / plat
+    plat_dir.mkdir(parents=True, exist_ok=True)
+    fcsv = plat_dir / f'{plat}_fix_commits{FORMATS[fmt]}'
+    bjson = plat_dir / f'{plat}_buggy_commits.jsonl.gz'
+    mcsv = plat_dir / f'{plat}_matrix{FORMATS[fmt]}'
+
+    state = plat_dir / f'{plat}_state.json'
+    legacy = plat_dir / f'{plat}_buggy_commits.json'
+    if legacy.exists() and not bjson.exists():
+        logger.info(f'Convert {legacy} to {bjson}')
+        convert_bug_commit_json(legacy, bjson)
+    for path, schema in [(fcsv, FIX_COMMIT_SCHEMA), (mcsv, MATRIX_SCHEMA)]:
+        if convert_dataset(path, schema):
+            logger.info(f'Converted {path.stem} to {fmt}')
+
+    if _do_all_data_exist([fcsv, bjson, mcsv]) and not inc:
+        logger.info(f'All files related to {plat} smart contract exist.')
+        return None
+
+    with GitCommit(git_addr, cache_dir=cache_dir, partial=partial,
+                   backend=backend, profile=profile,
+                   diff_limits=diff_limits) as gc:
+        tips = gc.get_tips()
+        if _do_all_data_exist([fcsv, bjson, mcsv]):
+            update_platform_datasets(gc, plat_dir, plat, workers, fmt)
+            _save_state(state, tips)
+            return gc.profiler and gc.profiler.rows()
+
+        # data created by an earlier run may miss commits after its tips
+        consistent = not fcsv.exists() and not bjson.exists()
+        if not fcsv.exists():
+            logger.info(f'Get bug-fixed commit data from {plat}')
+            create_fix_commit_csv(gc, fcsv, workers=workers)
         else:
-            row = row[0]
-
-        row['commit'] = commit if not row.get('commit') else row['commit']
-        if not row.get('la') or not row.get('ld'):
-            la, ld = gc.get_numstat(commit)
-            row['la'] = la
-            row['ld'] = ld
-        if not row.get('ns') or not row.get('nd') or not row.get('nf'):
-            fnames = gc.get_changed_filenames(commit)
-            if not row.get('ns'):
-                row['ns'] = len(get_subsys(fnames))
-            if not row.get('nd'):
-                row['nd'] = len(get_dir(fnames))
-            if not row.get('nf'):
-                row['nf'] = len(fnames)
-        if not row.get('nuc') or not row.get('ndev'):
-            hset, anset = gc.get_former_commits(commit)
-            row['nuc'] = len(hset)
-            row['ndev'] = len(anset)
-        if not row.get('inter'):
-            row['inter'] = gc.get_aver_interval(commit)
-        if not row.get('ent'):
-            row['ent'] = gc.get_entropy(commit)
-        if not row.get('exp'):
-            row['exp'] = len(gc.get_author_exp(commit))
-        if not row.get('rexp'):
-            row['rexp'] = gc.get_author_recent_exp(commit)
-        if not row.get('sexp'):
-            row['sexp'] = gc.get_author_subssys_exp(commit)
-        if not row.get('pod'):
-            row['pod'] = gc.get_author_proportion(commit)
-        if not row.get('fix'):
-            row['fix'] = commit in fix_commits
-        if not row.get('buggy'):
-            row['buggy'] = commit in bug_commits
-        if not row.get('time'):
-            row['time'] = gc.get_author_time(commit)
+            logger.info(f'Data exists. Skip collect data {fcsv}')
+
+        if not bjson.exists():
+            logger.info(f'Get buggy commits data from {plat}')
+            create_bug_commit_json(gc, fcsv, bjson)
+        else:
+            logger.info(f'Data exists. Skip collect data {bjson}')
+
+        logger.info(f'Get git matrixes from {plat}')
+        create_git_matrix_csv(gc, fcsv, mcsv, workers=workers)
+        if consistent:
+            _save_state(state, tips)
+
+    return gc.profiler and gc.profiler.rows()
 
-        rows.append(row)
 
-    new_df = pd.DataFrame(rows)
-    new_df.to_csv(tgt_csv, index=False)
+def _load_state(path: Path) -> dict:
+    if not path.exists():
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_state(path: Path, tips: dict):
+    """ Save the ref tips whose commits are all in the datasets.
+    """
+    tmp = path.with_name(f'{path.name}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'tips': tips}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def update_platform_datasets(gc: GitCommit,
+                             plat_dir: Path,
+                             plat: str,
+                             workers: int = 1,
+                             fmt: str = 'csv'):
+    """ Add the commits made since the last run to the datasets of a
+    platform.
+
+    New commits are the ones reachable from the refs of the repo but not
+    from the tips saved in `<plat>_state.json`. Only the new fix commits
+    are blamed, and the `buggy` labels of older commits are updated.
+    Without a state file, new commits are the ones missing from the buggy
+    commit file.
+
+    Args:
+        gc (GitCommit): git commit class
+        plat_dir (Path): folder of the datasets of the platform
+        plat (str): name of the platform
+        workers (int, optional): number of fix commits blamed, and of
+                                 processes computing the git matrix, at
+                                 the same time. Defaults to 1.
+        fmt (str, optional): format of the fix commit and matrix datasets.
+                             Defaults to 'csv'.
+    """
+    fcsv = plat_dir / f'{plat}_fix_commits{FORMATS[fmt]}'
+    bjson = plat_dir / f'{plat}_buggy_commits.jsonl.gz'
+    mcsv = plat_dir / f'{plat}_matrix{FORMATS[fmt]}'
+    state = _load_state(plat_dir / f'{plat}_state.json')
+    if state is not None:
+        commits = set(gc.get_commits_since(state['tips'].values()))
+    else:
+        done = {row['commit'] for row in read_bug_commit_json(bjson)}
+        commits = set(gc.get_commits()) - done
+    logger.info(f'{len(commits)} new commits since the last run of {plat}')
+    if not commits and not _checkpoint_path(mcsv).exists():
+        return
+
+    create_fix_commit_csv(gc, fcsv, commits, workers)
+    create_bug_commit_json(gc, fcsv, bjson, commits)
+    create_git_matrix_csv(gc, fcsv, mcsv, commits=commits, workers=workers)
+
+
+def _create_platform_datasets_job(slots: Queue, *args):
+    """ Run `create_platform_datasets` in a worker thread
+
+    Logs are tagged with the platform name and the progress bars of the
+    platform take a free line of the terminal.
+    """
+    plat = args[0]
+    pos = slots.get()
+    token = _platform.set((plat, pos))
+    try:
+        with logger.contextualize(plat=plat):
+            return create_platform_datasets(*args)
+    finally:
+        _platform.reset(token)
+        slots.put(pos)
 
 
 def create_contract_datasets(platform_csv: Path,
                              saved_dir: Path,
-                             inc: bool):
+                             inc: bool,
+                             jobs: int = 1,
+                             cache_dir: Path = None,
+                             partial: bool = False,
+                             backend: str = 'subprocess',
+                             profile: Path = None,
+                             diff_limits: DiffLimits = None,
+                             workers: int = 1,
+                             fmt: str = 'csv'):
     """ Create csv datasets for smart contracts.
 
     Args:
         platform_csv (Path): path to `platform.csv`
         saved_dir (Path): where to put newly created csv files
         inc (bool): run in incremental mode
+        jobs (int, optional): number of platforms collected at the same
+                              time. Defaults to 1.
+        cache_dir (Path, optional): keep git repos in this directory and
+                                    only fetch new objects on later runs.
+                                    Defaults to None.
+        partial (bool, optional): clone without file contents. Defaults to
+                                  False.
+        backend (str, optional): git backend reading diffs and files,
+                                 'subprocess' or 'pygit2'. Defaults to
+                                 'subprocess'.
+        profile (Path, optional): write calls, wall time and output size
+                                  of git commands per platform and
+                                  GitCommit method to this json or csv
+                                  file. Defaults to None, no profiling.
+        diff_limits (DiffLimits, optional): files left out of the changes
+                                            of commits, e.g. generated or
+                                            vendored files. Defaults to
+                                            None, keep all files.
+        workers (int, optional): number of fix commits blamed, and of
+                                 processes computing the git matrix, at
+                                 the same time for each platform. Defaults
+                                 to 1.
+        fmt (str, optional): format of the fix commit and matrix datasets,
+                             'csv', or 'parquet' and 'feather' which need
+                             pyarrow. Defaults to 'csv'.
     """
     df = pd.read_csv(platform_csv, index_col=False)
-    for _, row in df.iterrows():
-        plat = row['platform']
-        git_addr = row['github_addr']
-        plat_dir = saved_dir / plat
-        plat_dir.mkdir(parents=True, exist_ok=True)
-        fcsv = plat_dir / f'{plat}_fix_commits.csv'
-        bjson = plat_dir / f'{plat}_buggy_commits.json'
-        mcsv = plat_dir / f'{plat}_matrix.csv'
-
-        if _do_all_data_exist([fcsv, bjson, mcsv]) and not inc:
-            logger.info(f'All files related to {plat} smart contract exist.')
-            continue
+    platforms = [(row['platform'], row['github_addr'])
+                 for _, row in df.iterrows()]
+    args = (saved_dir, inc, cache_dir, partial, backend, profile is not None,
+            diff_limits, workers, fmt)
+    profiles = {}
+    if jobs <= 1:
+        for plat, git_addr in platforms:
+            with logger.contextualize(plat=plat):
+                profiles[plat] = create_platform_datasets(plat, git_addr,
+                                                          *args)
+        if profile is not None:
+            write_git_profile(profiles, profile)
+        return
+
+    slots = Queue()
+    for pos in range(jobs):
+        slots.put(pos)
+    failed = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(_create_platform_datasets_job, slots, plat, git_addr,
+                        *args): plat
+            for plat, git_addr in platforms
+        }
+        for future in as_completed(futures):
+            plat = futures[future]
+            try:
+                profiles[plat] = future.result()
+            except Exception:
+                logger.opt(exception=True).bind(plat=plat).error(
+                    f'Failed to collect data of {plat}'
+                )
+                failed.append(plat)
+    if profile is not None:
+        write_git_profile(profiles, profile)
+    if failed:
+        raise RuntimeError(f'Failed to collect data of {", ".join(failed)}')
+
+
+def write_git_profile(profiles: dict, path: Path):
+    """ Write the git command profiles of platforms to a json or csv file.
 
-        with GitCommit(git_addr) as gc:
-            if not fcsv.exists():
-                logger.info(f'Get bug-fixed commit data from {plat}')
-                create_fix_commit_csv(gc, fcsv)
-            else:
-                logger.info(f'Data exists. Skip collect data {fcsv}')
-
-            if not bjson.exists():
-                logger.info(f'Get buggy commits data from {plat}')
-                create_bug_commit_json(gc, fcsv, bjson)
-            else:
-                logger.info(f'Data exists. Skip collect data {bjson}')
-
-            logger.info(f'Get git matrixes from {plat}')
-            create_git_matrix_csv(gc, fcsv, mcsv)
+    Args:
+        profiles (dict): {platform: records of `Profiler.rows`}, platforms
+                         without records are left out
+        path (Path): json file, or csv file for any other suffix
+    """
+    rows = [{'platform': plat, **row}
+            for plat, records in profiles.items() if records
+            for row in records]
+    df = pd.DataFrame(rows, columns=['platform', 'method', 'command',
+                                     'calls', 'seconds', 'bytes'])
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == '.json':
+        df.to_json(path, orient='records', indent=2)
+    else:
+        df.to_csv(path, index=False)
+    logger.info(f'Git command profile saved to {path}')
@@ -0,0 +1,546 @@
+"""Backends answering git queries for `GitCommit`.
+
+`SubprocessBackend` runs the git command line tool in the repo and is the
+default. `Pygit2Backend` reads commits, trees, blobs and diffs in-process
+from the object database through libgit2, so per-commit queries do not
+start a process each. It needs the optional `pygit2` package. libgit2
+pairs renamed files by another similarity metric than git, so the pairs
+are checked against `git diff` when a commit adds and deletes files.
+"""
+import re
+import shlex
+import subprocess
+import threading
+from subprocess import check_output
+from collections import defaultdict
+from typing import Iterator, Iterable, Callable
+from .catfile import CatFile, blob_stats
+from .index import DiffEntry, parse_diff_summary, parse_name_status
+from .parser import split_patches, match_pathspec
+
+__all__ = ['SubprocessBackend', 'Pygit2Backend', 'BACKENDS', 'get_backend']
+
+STREAM_CHUNK = 1 << 16
+# scale of rename scores in git
+MAX_SCORE = 60000
+# file mode of submodules
+GITLINK = 0o160000
+
+
+def run_command(cmd: str, cwd: str = None, input: str = None) -> str:
+    """ run command line and return output
+
+    Parameters
+    ----------
+    cmd : str
+        command
+    cwd : str, optional
+        working directory of the command, by default the current one
+    input : str, optional
+        standard input of the command, by default None
+
+    Returns
+    -------
+    str
+        standard output
+    """
+    # stdout = check_output(shlex.split(cmd, posix=False), encoding='utf-8')\
+    #          .rstrip('\n')
+    stdout = check_output(cmd, shell=True, cwd=cwd, input=input,
+                          encoding='utf-8').rstrip('\n')
+    return stdout
+
+
+def stream_command(cmd: str, cwd: str = None) -> Iterator[str]:
+    """ run command line and yield its output piece by piece
+
+    Parameters
+    ----------
+    cmd : str
+        command
+    cwd : str, optional
+        working directory of the command, by default the current one
+
+    Yields
+    ------
+    str
+        chunks of standard output
+    """
+    with subprocess.Popen(cmd, shell=True, cwd=cwd, stdout=subprocess.PIPE,
+                          encoding='utf-8', errors='replace') as ps:
+        while True:
+            chunk = ps.stdout.read(STREAM_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+    if ps.returncode != 0:
+        raise subprocess.CalledProcessError(ps.returncode, cmd)
+
+
+def _span_hashes(data: bytes, text: bool) -> dict:
+    """ Split data into spans ending with LF or 64 bytes long and count
+    bytes per span hash, as git's diffcore-delta does
+    """
+    counts = defaultdict(int)
+    n, accum1, accum2 = 0, 0, 0
+    size = len(data)
+    for i, c in enumerate(data):
+        # CR of CRLF is ignored in text files
+        if text and c == 13 and i + 1 < size and data[i + 1] == 10:
+            continue
+        old = accum1
+        accum1 = ((accum1 << 7) ^ (accum2 >> 25)) & 0xFFFFFFFF
+        accum2 = ((accum2 << 7) ^ (old >> 25)) & 0xFFFFFFFF
+        accum1 = (accum1 + c) & 0xFFFFFFFF
+        n += 1
+        if n < 64 and c != 10:
+            continue
+        counts[((accum1 + accum2 * 0x61) & 0xFFFFFFFF) % 107927] += n
+        n, accum1, accum2 = 0, 0, 0
+    if n > 0:
+        counts[((accum1 + accum2 * 0x61) & 0xFFFFFFFF) % 107927] += n
+    return counts
+
+
+def similarity(src: bytes, dst: bytes, binary: bool = False) -> int:
+    """ Estimate how similar two files are in percent, the same way as
+    `similarity index` lines of `git diff`
+
+    Parameters
+    ----------
+    src : bytes
+        content of the old file
+    dst : bytes
+        content of the new file
+    binary : bool, optional
+        whether the files are binary, by default False
+
+    Returns
+    -------
+    int
+        similarity, 0 to 100
+    """
+    max_size = max(len(src), len(dst))
+    if not dst:
+        return 0
+    src_cnt = _span_hashes(src, not binary)
+    dst_cnt = _span_hashes(dst, not binary)
+    copied = sum(min(cnt, dst_cnt.get(h, 0)) for h, cnt in src_cnt.items())
+    score = copied * MAX_SCORE // max_size
+    return score * 100 // MAX_SCORE
+
+
+class SubprocessBackend():
+    """Run git queries with the git command line tool
+
+    Blobs are read through persistent `git cat-file` workers. Commands are
+    recorded by `profiler` when it is set.
+    """
+    name = 'subprocess'
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            directory of the git repo
+        """
+        self.path = path
+        self.catfile = CatFile(path)
+        self.profiler = None
+
+    def _call(self, command: str, fn: Callable, *args):
+        if self.profiler is None:
+            return fn(*args)
+        return self.profiler.call(command, fn, *args)
+
+    def run(self, cmd: str, input: str = None) -> str:
+        """ run a command in the repo and return output
+        """
+        return self._call(cmd, run_command, cmd, self.path, input)
+
+    def stream(self, cmd: str) -> Iterator[str]:
+        """ run a command in the repo and yield its output piece by piece
+        """
+        chunks = stream_command(cmd, self.path)
+        if self.profiler is None:
+            return chunks
+        return self.profiler.stream(cmd, chunks)
+
+    def diff_summary(self, commit: str) -> tuple:
+        """ Get status and line stats of every file changed by a commit
+
+        Same as `git diff --raw --numstat` against the first parent, with
+        renames detected and submodules ignored.
+
+        Parameters
+        ----------
+        commit : str
+            commit id, must have a parent
+
+        Returns
+        -------
+        tuple
+            DiffEntry of every changed file, ordered by path
+        """
+        cmd = (
+            f'git --no-pager diff --raw --numstat -z --ignore-submodules '
+            f'{commit}^ {commit}'
+        )
+        return parse_diff_summary(self.run(cmd))
+
+    def diff_text(self, commit: str, fname: str = None) -> str:
+        """ Get the patch of a commit against its first parent, without
+        context lines
+
+        Parameters
+        ----------
+        commit : str
+            commit id, must have a parent
+        fname : str, optional
+            only show changes of this file, by default None. Renames are
+            not detected then, as with a pathspec in `git diff`
+
+        Returns
+        -------
+        str
+            output of `git diff -U0`
+        """
+        if fname is None:
+            return self.run(f'git --no-pager diff -U0 {commit}^ {commit}')
+        return self.run(f'git --no-pager diff {commit}^ {commit} -U0 '
+                        f'-- {fname}')
+
+    def iter_diff(self,
+                  commit: str,
+                  exclude: Iterable[str] = (),
+                  max_bytes: int = None,
+                  skip: Iterable[str] = ()) -> Iterator[str]:
+        """ Stream the patch of a commit against its first parent file by
+        file, without context lines
+
+        Files matching an exclude pattern are left out by git, so their
+        changes are never read. Skipped files are dropped while streaming,
+        so neither list grows the command line.
+
+        Parameters
+        ----------
+        commit : str
+            commit id, must have a parent
+        exclude : Iterable[str], optional
+            pathspecs of git, e.g. `*.json` or `vendor`, of the files to
+            leave out
+        max_bytes : int, optional
+            drop patches larger than this, by default None
+        skip : Iterable[str], optional
+            paths of other files to leave out. A renamed file is left out
+            if either of its paths is given
+
+        Yields
+        ------
+        str
+            patch of a file, as in the output of `diff_text`
+        """
+        cmd = f'git --no-pager diff -U0 {commit}^ {commit}'
+        if exclude:
+            specs = ' '.join(shlex.quote(f':(exclude){pattern}')
+                             for pattern in exclude)
+            cmd = f'{cmd} -- {specs}'
+        return split_patches(self.stream(cmd), max_bytes, skip)
+
+    def read_blob(self, commit: str, path: str) -> bytes:
+        """ Read a file in a commit
+
+        Returns
+        -------
+        bytes
+            content of the file, None if it does not exist
+        """
+        return self._call('git cat-file', self.catfile.read, commit, path)
+
+    def blob_stats(self, pairs: Iterable[tuple]) -> dict:
+        """ Get sizes and line counts of many files
+
+        Parameters
+        ----------
+        pairs : Iterable[tuple]
+            [(commit, path)]
+
+        Returns
+        -------
+        dict
+            {(commit, path): (size, lines)}, None for missing files
+        """
+        return self._call('git cat-file', self.catfile.stats, pairs)
+
+    def close(self):
+        self.catfile.close()
+
+
+class Pygit2Backend(SubprocessBackend):
+    """Read commits, trees and diffs in-process with libgit2
+
+    Diff summaries, patches and blobs come from the object database.
+    Bulk `git log` passes, blame and clone/fetch still run the git command
+    line tool: they start one process per repo or per file, and git's
+    rename and copy heuristics are kept exactly.
+
+    The similarity metric of libgit2 differs from git's, so its rename
+    pairs are compared with those of `git diff --name-status` on commits
+    which may rename files. Commits where they differ are answered by the
+    subprocess backend.
+    """
+    name = 'pygit2'
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        try:
+            import pygit2
+            from pygit2.enums import DiffOption
+        except ImportError as e:
+            raise ImportError('The pygit2 backend needs the pygit2 package: '
+                              'pip install pygit2') from e
+        self.repo = pygit2.Repository(path)
+        self._commit_type = pygit2.Commit
+        self._flags = DiffOption.INCLUDE_TYPECHANGE
+        # `git diff --ignore-submodules`
+        self._no_submodules = DiffOption.IGNORE_SUBMODULES
+        self._ambiguous = pygit2.AmbiguousError
+        # same length of abbreviated ids as `git diff` would use
+        try:
+            self.abbrev = len(self.run('git rev-parse --short HEAD'))
+        except subprocess.CalledProcessError:
+            self.abbrev = 7
+        self._lock = threading.RLock()
+        # {commit: renamed and copied files found by git}
+        self._git_pairs = {}
+
+    def close(self):
+        super().close()
+        # release the files of the object database now, not at teardown
+        self.repo.free()
+
+    def _commit(self, commit: str):
+        return self.repo.revparse_single(commit).peel(self._commit_type)
+
+    def _diff(self,
+              commit: str,
+              renames: bool = True,
+              submodules: bool = True):
+        obj = self._commit(commit)
+        flags = self._flags if submodules else (self._flags
+                                                | self._no_submodules)
+        diff = self.repo.diff(obj.parents[0].tree, obj.tree, flags=flags,
+                              context_lines=0, interhunk_lines=0)
+        if renames:
+            status = {delta.status_char() for delta in diff.deltas}
+            diff.find_similar()
+            pairs = self._pairs(diff)
+            if ('A' in status and 'D' in status or pairs) \
+                    and pairs != self._renames(commit):
+                return None
+        return diff
+
+    @staticmethod
+    def _pairs(diff) -> frozenset:
+        return frozenset((delta.status_char(), delta.old_file.path,
+                          delta.new_file.path)
+                         for delta in diff.deltas
+                         if delta.status_char() in 'RC')
+
+    def _renames(self, commit: str) -> frozenset:
+        """ Renamed and copied files of a commit as found by `git diff`
+
+        Returns
+        -------
+        frozenset
+            {(status, old path, new path)}
+        """
+        if commit not in self._git_pairs:
+            out = self.run(f'git --no-pager diff --name-status -z '
+                           f'{commit}^ {commit}')
+            self._git_pairs[commit] = frozenset(
+                (status, old, path)
+                for status, path, old in parse_name_status(out)
+                if old is not None)
+        return self._git_pairs[commit]
+
+    def diff_summary(self, commit: str) -> tuple:
+        summary = self._call('pygit2 diff', self._diff_summary, commit)
+        if summary is None:
+            # libgit2 pairs the renamed files otherwise than git
+            return super().diff_summary(commit)
+        return summary
+
+    def _diff_summary(self, commit: str) -> tuple:
+        entries = []
+        with self._lock:
+            diff = self._diff(commit, submodules=False)
+            if diff is None:
+                return None
+            for patch in diff:
+                delta = patch.delta
+                if GITLINK in (delta.old_file.mode, delta.new_file.mode):
+                    # added or removed submodules are ignored by git too
+                    continue
+                status = delta.status_char()
+                old, new = delta.old_file.path, delta.new_file.path
+                if delta.is_binary:
+                    added, deleted = None, None
+                else:
+                    _, added, deleted = patch.line_stats
+                entries.append(DiffEntry(
+                    status,
+                    old if status == 'D' else new,
+                    old if status in 'RC' else None,
+                    added,
+                    deleted,
+                ))
+        return tuple(sorted(entries, key=lambda e: e.path))
+
+    def _abbrev(self, oid) -> str:
+        """ Abbreviate an object id the way git does, extending it until it
+        is unique in the repo
+        """
+        hex = str(oid)
+        n = self.abbrev
+        if not oid.raw.strip(b'\0'):
+            return hex[:n]
+        while n < len(hex):
+            try:
+                self.repo[hex[:n]]
+                break
+            except self._ambiguous:
+                n += 1
+            except KeyError:
+                # commits of submodules are not in the repo
+                break
+        return hex[:n]
+
+    def _blob_size(self, oid) -> int:
+        if not oid.raw.strip(b'\0'):
+            return 0
+        try:
+            return self.repo.odb.read_header(oid)[1]
+        except KeyError:
+            # commits of submodules are not in the repo
+            return 0
+
+    def _patch_text(self, patch) -> str:
+        """ Patch of a file with abbreviated ids and similarity computed
+        as in git
+        """
+        delta = patch.delta
+        old, new = delta.old_file.id, delta.new_file.id
+        text = re.sub(r'^index [0-9a-f]+\.\.[0-9a-f]+',
+                      f'index {self._abbrev(old)}..{self._abbrev(new)}',
+                      patch.text, count=1, flags=re.M)
+        if delta.status_char() in 'RC' and old != new:
+            score = similarity(self.repo[old].data, self.repo[new].data,
+                               delta.is_binary)
+            text = re.sub(r'^similarity index \d+%',
+                          f'similarity index {score}%',
+                          text, count=1, flags=re.M)
+        return text
+
+    def diff_text(self, commit: str, fname: str = None) -> str:
+        return self._call('pygit2 diff', self._diff_text, commit, fname)
+
+    def _diff_text(self, commit: str, fname: str = None) -> str:
+        if fname is None:
+            return ''.join(self._iter_diff(commit)).rstrip('\n')
+        with self._lock:
+            diff = self._diff(commit, renames=False)
+            patches = [patch for patch in diff
+                       if fname in (patch.delta.old_file.path,
+                                    patch.delta.new_file.path)]
+            patches.sort(key=lambda p: p.delta.new_file.path)
+            text = ''.join(self._patch_text(patch) for patch in patches)
+        return text.rstrip('\n')
+
+    def iter_diff(self,
+                  commit: str,
+                  exclude: Iterable[str] = (),
+                  max_bytes: int = None,
+                  skip: Iterable[str] = ()) -> Iterator[str]:
+        patches = self._iter_diff(commit, exclude, max_bytes, skip)
+        if self.profiler is None:
+            return patches
+        return self.profiler.stream('pygit2 diff', patches)
+
+    def _iter_diff(self,
+                   commit: str,
+                   exclude: Iterable[str] = (),
+                   max_bytes: int = None,
+                   skip: Iterable[str] = ()) -> Iterator[str]:
+        exclude, skip = tuple(exclude), set(skip)
+
+        def excluded(path):
+            return any(match_pathspec(path, pattern) for pattern in exclude)
+
+        def left_out(path):
+            return path in skip or excluded(path)
+
+        with self._lock:
+            diff = self._diff(commit)
+            # git filters paths before pairing renames, so the other path
+            # of a half excluded rename is added or deleted
+            if diff is not None and exclude and any(
+                    excluded(d.old_file.path) != excluded(d.new_file.path)
+                    for d in diff.deltas):
+                diff = None
+        if diff is None:
+            yield from super().iter_diff(commit, exclude, max_bytes, skip)
+            return
+        with self._lock:
+            order = sorted((delta.new_file.path, i, delta)
+                           for i, delta in enumerate(diff.deltas)
+                           if not left_out(delta.old_file.path)
+                           and not left_out(delta.new_file.path))
+        # patches are made one at a time, skipping those which are larger
+        # than max_bytes for sure: the lines a patch adds or deletes are at
+        # least as long as the change in size of the file
+        for _, i, delta in order:
+            with self._lock:
+                if max_bytes is not None:
+                    if abs(self._blob_size(delta.new_file.id)
+                           - self._blob_size(delta.old_file.id)) > max_bytes:
+                        continue
+                text = self._patch_text(diff[i])
+            if max_bytes is None or len(text.encode('utf-8')) <= max_bytes:
+                yield text
+
+    def read_blob(self, commit: str, path: str) -> bytes:
+        return self._call('pygit2 blob', self._read_blob, commit, path)
+
+    def blob_stats(self, pairs: Iterable[tuple]) -> dict:
+        return self._call('pygit2 blob', blob_stats, pairs, self._read_blob)
+
+    def _read_blob(self, commit: str, path: str) -> bytes:
+        with self._lock:
+            try:
+                return self._commit(commit).tree[path].data
+            except (KeyError, ValueError):
+                return None
+
+
+BACKENDS = {
+    SubprocessBackend.name: SubprocessBackend,
+    Pygit2Backend.name: Pygit2Backend,
+}
+
+
+def get_backend(name: str, path: str) -> SubprocessBackend:
+    """ Create a backend by its name
+
+    Parameters
+    ----------
+    name : str
+        one of BACKENDS
+    path : str
+        directory of the git repo
+    """
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown git backend {name!r}, '
+                         f'choose from {", ".join(BACKENDS)}')
+    return BACKENDS[name](path)
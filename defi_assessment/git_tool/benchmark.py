@@ -0,0 +1,329 @@
+"""Compare the git backends on a generated repo.
+
+    python -m defi_assessment.git_tool.benchmark --commits 1000
+
+A repo with random edits, renames, copies, splits, deletes and merges is
+written with `git fast-import`. Renamed and copied files are often edited
+in the same commit, some of them about half, near the similarity where
+git stops pairing them.
+Every backend then answers the per-commit queries made while collecting
+the datasets, and the answers are checked to be equal. The features read
+from file histories are also checked to be the same with the commit index
+as with the `git log --follow` command of every file.
+"""
+import os
+import math
+import random
+import subprocess
+import tempfile
+import time
+import click
+from .backend import BACKENDS, get_backend, run_command
+from .gitcmd import GitCommit
+
+__all__ = ['make_repo', 'run_queries', 'compare_backends',
+           'history_features', 'compare_history']
+
+AUTHORS = ['Alice <alice@example.com>', 'Bob <bob@example.com>',
+           'Carol <carol@example.com>']
+DIRS = ['contracts', 'contracts/lib', 'test', 'scripts', '']
+EXTS = ['.sol', '.js', '.json', '.md']
+
+
+def _data(content: str) -> str:
+    return f'data {len(content.encode("utf-8"))}\n{content}\n'
+
+
+def _random_lines(rng: random.Random, n: int) -> list:
+    return [f'{rng.choice(["uint", "require", "emit", "return"])} '
+            f'x{rng.randint(0, 99)} = {rng.randint(0, 9999)};'
+            for _ in range(n)]
+
+
+def _rewrite(rng: random.Random, lines: list, share: float = None):
+    """ Replace a share of the lines of a file, by default a random one
+    """
+    if share is None:
+        share = rng.uniform(0.2, 0.8)
+    for i in range(len(lines)):
+        if rng.random() < share:
+            lines[i] = _random_lines(rng, 1)[0]
+
+
+def make_repo(path: str, commits: int = 300, seed: int = 0) -> str:
+    """ Generate a bare git repo with random history
+
+    Parameters
+    ----------
+    path : str
+        directory of the new repo
+    commits : int, optional
+        number of commits on the main branch, by default 300
+    seed : int, optional
+        seed of the random generator, by default 0
+
+    Returns
+    -------
+    str
+        path of the repo
+    """
+    rng = random.Random(seed)
+    files = {}
+    stream = []
+    t = 1600000000
+
+    def commit(mark, parents, ops, msg):
+        nonlocal t
+        t += rng.randint(60, 86400)
+        author = rng.choice(AUTHORS)
+        stream.append(f'commit refs/heads/main\nmark :{mark}\n'
+                      f'author {author} {t} +0000\n'
+                      f'committer {author} {t} +0000\n')
+        stream.append(_data(msg))
+        if parents:
+            stream.append(f'from :{parents[0]}\n')
+        stream.extend(f'merge :{p}\n' for p in parents[1:])
+        stream.extend(ops)
+
+    def edit(state, n):
+        ops = []
+
+        def write(name):
+            ops.append(f'M 100644 inline {name}\n')
+            ops.append(_data('\n'.join(state[name]) + '\n'))
+
+        def new_name(prefix):
+            return os.path.join(rng.choice(DIRS), f'{prefix}'
+                                f'{rng.randint(0, 10**6)}{rng.choice(EXTS)}')
+
+        for _ in range(n):
+            op = rng.random()
+            if not state or op < 0.2:
+                name = new_name('f')
+                state[name] = _random_lines(rng, rng.randint(1, 80))
+            elif op < 0.27 and len(state) > 3:
+                name = rng.choice(sorted(state))
+                del state[name]
+                ops.append(f'D {name}\n')
+                continue
+            elif op < 0.40:
+                name = rng.choice(sorted(state))
+                if op < 0.33:
+                    # moved to another directory or also renamed
+                    new = new_name('r') if rng.random() < 0.5 else \
+                        os.path.join(rng.choice(DIRS),
+                                     'r' + os.path.basename(name))
+                    if new in state:
+                        continue
+                    state[new] = state.pop(name)
+                    ops.append(f'R {name} {new}\n')
+                else:
+                    # a copy, maybe of a file changed by the same commit
+                    new = new_name('c')
+                    if new in state:
+                        continue
+                    state[new] = list(state[name])
+                    if rng.random() < 0.5:
+                        _rewrite(rng, state[name])
+                        write(name)
+                    write(new)
+                name = new
+                choice = rng.random()
+                if choice < 0.4:
+                    continue
+                if choice < 0.7:
+                    # around the 50% similarity threshold of git
+                    _rewrite(rng, state[name], rng.uniform(0.4, 0.6))
+                    write(name)
+                    continue
+            elif op < 0.45 and len(state) > 3:
+                # a file split in two, both similar to the deleted one
+                name = rng.choice(sorted(state))
+                lines = state.pop(name)
+                ops.append(f'D {name}\n')
+                for _ in range(2):
+                    new = new_name('s')
+                    state[new] = list(lines)
+                    _rewrite(rng, state[new], rng.uniform(0.4, 0.6))
+                    write(new)
+                continue
+            else:
+                name = rng.choice(sorted(state))
+            lines = state[name]
+            for _ in range(rng.randint(1, 6)):
+                i = rng.randint(0, len(lines))
+                if rng.random() < 0.4 and len(lines) > 1:
+                    lines.pop(min(i, len(lines) - 1))
+                else:
+                    lines[i:i] = _random_lines(rng, rng.randint(1, 3))
+            write(name)
+        return ops
+
+    mark, head = 0, None
+    for i in range(commits):
+        mark += 1
+        msg = rng.choice(['Fix overflow', 'add feature', 'update docs',
+                          'fix: typo', 'refactor'])
+        if i % 25 == 24:
+            # a side commit merged back into main
+            side = {k: list(v) for k, v in files.items()}
+            commit(mark, [head], edit(side, 2), 'side change')
+            mark += 1
+            ops = edit(files, 1)
+            ops.extend(f'M 100644 inline {name}\n' + _data(
+                '\n'.join(lines) + '\n') for name, lines in side.items())
+            ops.extend(f'D {name}\n' for name in set(files) - set(side))
+            files = side
+            commit(mark, [head, mark - 1], ops, 'Merge branch side')
+        else:
+            commit(mark, [head] if head else [], edit(files, rng.randint(
+                1, 4)), msg)
+        head = mark
+
+    run_command(f'git init --quiet --bare {path}')
+    subprocess.run(['git', 'fast-import', '--quiet'], cwd=path, check=True,
+                   input=''.join(stream).encode('utf-8'))
+    run_command('git symbolic-ref HEAD refs/heads/main', path)
+    return path
+
+
+def run_queries(backend, commits: list) -> tuple:
+    """ Make the per-commit queries of the datasets with a backend
+
+    Parameters
+    ----------
+    backend : SubprocessBackend
+        git backend
+    commits : list
+        commit ids having a parent
+
+    Returns
+    -------
+    tuple
+        (answers, seconds)
+    """
+    res = []
+    start = time.perf_counter()
+    for commit in commits:
+        summary = backend.diff_summary(commit)
+        res.append(summary)
+        res.append(backend.diff_text(commit))
+        res.append(list(backend.iter_diff(commit)))
+        paths = [e.path for e in summary if e.status != 'D']
+        res.extend(backend.diff_text(commit, path) for path in paths)
+        res.append(backend.blob_stats((commit, path) for path in paths))
+    return res, time.perf_counter() - start
+
+
+def compare_backends(path: str, names: list = None) -> dict:
+    """ Time the backends on a repo and check that their answers match
+
+    Parameters
+    ----------
+    path : str
+        directory of the git repo
+    names : list, optional
+        backends to compare, by default all of BACKENDS
+
+    Returns
+    -------
+    dict
+        {backend name: seconds}
+    """
+    commits = run_command('git rev-list --all --min-parents=1',
+                          path).split()
+    expected, times = None, {}
+    for name in names or BACKENDS:
+        backend = get_backend(name, path)
+        try:
+            res, times[name] = run_queries(backend, commits)
+        finally:
+            backend.close()
+        if expected is None:
+            expected = res
+        elif res != expected:
+            diff = sum(a != b for a, b in zip(res, expected))
+            raise RuntimeError(f'Backend {name} gives {diff} different '
+                               f'answers on {path}')
+    return times
+
+
+def history_features(gc: GitCommit, commits: list) -> dict:
+    """ Get the features of commits read from the histories of their files
+
+    Parameters
+    ----------
+    gc : GitCommit
+        git repo
+    commits : list
+        commit ids having a parent
+
+    Returns
+    -------
+    dict
+        {commit: (nuc, ndev, pod, inter)}
+    """
+    res = {}
+    for commit in commits:
+        hset, anset = gc.get_former_commits(commit)
+        res[commit] = (len(hset), len(anset),
+                       gc.get_author_proportion(commit),
+                       gc.get_aver_interval(commit))
+    return res
+
+
+def compare_history(path: str) -> dict:
+    """ Time the file history features with and without the commit index
+    and check that they match
+
+    Parameters
+    ----------
+    path : str
+        directory of the git repo
+
+    Returns
+    -------
+    dict
+        {'index' or 'follow': seconds}
+    """
+    commits = run_command('git rev-list --all --no-merges --min-parents=1',
+                          path).split()
+    res, times = {}, {}
+    for name, indexed in [('index', True), ('follow', False)]:
+        start = time.perf_counter()
+        with GitCommit(path, indexed=indexed, path=path) as gc:
+            res[name] = history_features(gc, commits)
+        times[name] = time.perf_counter() - start
+    diff = [c for c in commits if not all(
+        math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+        for a, b in zip(res['index'][c], res['follow'][c])
+    )]
+    if diff:
+        raise RuntimeError(f'The commit index gives different nuc, ndev, '
+                           f'pod or inter for {len(diff)} commits on '
+                           f'{path}, e.g. {diff[0]}')
+    return times
+
+
+@click.command()
+@click.option('--commits', '-n', default=300, show_default=True,
+              help='Number of commits of the generated repo.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--backend', '-b', 'names', multiple=True,
+              type=click.Choice(list(BACKENDS)),
+              help='Backends to compare, all by default.')
+@click.option('--history/--no-history', default=True, show_default=True,
+              help='Also compare the file history features with and '
+                   'without the commit index.')
+def main(commits, seed, names, history):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_repo(os.path.join(tmp, 'repo.git'), commits, seed)
+        times = compare_backends(path, list(names) or None)
+        if history:
+            times.update(compare_history(path))
+    for name, secs in times.items():
+        click.echo(f'{name:>12}: {secs:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
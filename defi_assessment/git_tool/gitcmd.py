@@ -1,39 +1,38 @@
 import os
 import subprocess
+import threading
 import tempfile
+import hashlib
 import re
 import shlex
 import logging
-from typing import Union
+from typing import Union, Iterator, Callable, List
 from subprocess import check_output
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from numpy import log2
-from .parser import get_subsys
+from .parser import get_subsys, std_commit, parse_blame_porcelain
+from .index import (LOG_FORMAT, HISTORY_FORMAT, CommitRecord, CommitIndex,
+                    DiffEntry, FileHistory, AuthorIndex, SubsystemIndex,
+                    parse_log, parse_history, parse_name_status)
+from .backend import run_command, get_backend
+from .profiling import Profiler
 
-__all__ = ['GitCommit']
+__all__ = ['GitCommit', 'DiffLimits', 'match_keyword', 'match_parents',
+           'FIX_MATCHERS', 'MERGE_MATCHERS']
 
 logger = logging.getLogger(__name__)
 
 COMMIT_LEN = 10
+BLAME_JOBS = 4
+SUMMARY_CACHE_SIZE = 4096
 
-
-def _run_command(cmd: str) -> str:
-    """ run command line and return output
-
-    Parameters
-    ----------
-    cmd : str
-        command
-
-    Returns
-    -------
-    str
-        standard output
-    """
-    # stdout = check_output(shlex.split(cmd, posix=False), encoding='utf-8')\
-    #          .rstrip('\n')
-    stdout = check_output(cmd, shell=True, encoding='utf-8').rstrip('\n')
-    return stdout
+# Files left out of commit diffs: patches larger than `max_bytes`, files
+# with more than `max_lines` added and deleted lines, and files whose path
+# matches one of the `exclude` pathspecs of git, e.g. `*.json` or `vendor`
+DiffLimits = namedtuple('DiffLimits', ['max_bytes', 'max_lines', 'exclude'],
+                        defaults=(None, None, ()))
 
 
 def _run_single_pipeline_commands(cmds: list) -> str:
@@ -47,36 +46,142 @@ def _run_single_pipeline_commands(cmds: list) -> str:
     return stdout
 
 
-def _std_commit(commit: str) -> str:
-    """ standardize a single commit id
+def match_keyword(key: str,
+                  field: str = 'msg') -> Callable[[CommitRecord], bool]:
+    """ Match commits having a keyword in their messages, ignoring case
 
-    Args:
-        commit (str): commit id
+    Parameters
+    ----------
+    key : str
+        keyword
+    field : str, optional
+        'msg' for the whole commit message or 'subject' for its first
+        line, by default 'msg'
+    """
+    key = key.lower()
+    return lambda rec: key in getattr(rec, field).lower()
 
-    Returns:
-        str: standardized commit id
+
+def match_parents(n: int = 2) -> Callable[[CommitRecord], bool]:
+    """ Match commits having at least `n` parents
     """
-    commit = re.sub(r'\W+', '', commit)
-    commit = commit[:8]
-    return commit
+    return lambda rec: len(rec.parents) >= n
+
+
+# a commit fixes a bug if its subject mentions "fix", and is a merge commit if
+# its message mentions "merge". Merge commits are never fix commits.
+FIX_MATCHERS = [match_keyword('fix', 'subject')]
+MERGE_MATCHERS = [match_keyword('merge')]
+
+
+def mirror_path(cache_dir: str, url: str) -> str:
+    """ Get where the mirror of a repo is kept in a cache directory
+
+    Parameters
+    ----------
+    cache_dir : str
+        cache directory
+    url : str
+        address of the git repo
+
+    Returns
+    -------
+    str
+        path of the bare repo, named after the owner and the repo
+    """
+    parts = [p for p in re.split(r'[/:]', re.sub(r'\.git$', '', url)) if p]
+    name = re.sub(r'[^\w.-]', '_', '_'.join(parts[-2:]))
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, f'{name}-{digest}.git')
 
 
 class GitCommit():
-    def __init__(self, url: str):
+    def __init__(self,
+                 url: str,
+                 indexed: bool = True,
+                 cache_dir: str = None,
+                 partial: bool = False,
+                 backend: str = 'subprocess',
+                 profile: bool = False,
+                 diff_limits: DiffLimits = None,
+                 path: str = None,
+                 index: CommitIndex = None):
+        """
+        Parameters
+        ----------
+        url : str
+            address of the git repo
+        indexed : bool, optional
+            answer per-commit queries from a commit index built by one
+            `git log` pass, by default True
+        cache_dir : str, optional
+            keep a bare clone of the repo in this directory and only fetch
+            new objects on later runs, by default None, which clones into a
+            temporary directory removed on exit
+        partial : bool, optional
+            clone with `--filter=blob:none`, by default False. Missing
+            file contents are fetched by git on demand, so this pays off
+            for stages which mostly need commit metadata
+        backend : str, optional
+            how diffs and files are read, 'subprocess' to run git or
+            'pygit2' to read them in-process with libgit2, by default
+            'subprocess'. See `backend.BACKENDS`
+        profile : bool, optional
+            record calls, wall time and output size of git commands in
+            `profiler`, by default False
+        diff_limits : DiffLimits, optional
+            files left out of `get_diff`, by default None for no limit
+        path : str, optional
+            use this existing clone of the repo, e.g. the `path` of another
+            `GitCommit`, by default None, which clones `url`
+        index : CommitIndex, optional
+            commit index of the repo built by another `GitCommit`, by
+            default None, which builds it on enter when `indexed`
+        """
         self.url = url
-        self.cwd = os.getcwd()
-        self.repo_dir = tempfile.TemporaryDirectory()
-        self._clone_repo(self.repo_dir.name)
+        self.partial = partial
+        self.indexed = indexed
+        self.index = index if indexed else None
+        self.history = None
+        self.authors = None
+        self.subsystems = None
+        self._follow_sources = {}
+        self._summary = lru_cache(maxsize=SUMMARY_CACHE_SIZE)(
+            self._load_diff_summary
+        )
+        self._lock = threading.RLock()
+        self.profiler = Profiler(self) if profile else None
+        self.diff_limits = diff_limits or DiffLimits()
+        if path is not None:
+            self.repo_dir = None
+            self.path = path
+        elif cache_dir is None:
+            self.repo_dir = tempfile.TemporaryDirectory()
+            self.path = self.repo_dir.name
+            self._clone_repo(self.path)
+        else:
+            self.repo_dir = None
+            self.path = mirror_path(str(cache_dir), url)
+            self._sync_mirror(self.path)
+        self.backend = get_backend(backend, self.path)
+        self.backend.profiler = self.profiler
 
     def __enter__(self):
-        os.chdir(self.repo_dir.name)
         self.init_commit = self.get_1st_commits()
+        # {length: root commit ids}, to look roots up by prefix
+        self._roots = defaultdict(set)
+        for c in self.init_commit:
+            self._roots[len(c)].add(c)
+        if self.indexed and self.index is None:
+            self.index = self.build_index()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        os.chdir(self.cwd)
+        logger.info(f'Diff summary cache: {self.diff_cache_info()}')
+        self.backend.close()
         # remove temporary directory
-        self.repo_dir.cleanup()
+        if self.repo_dir is not None:
+            self.repo_dir.cleanup()
 
     def _clone_repo(self, dir: str):
         """ Clone a git repo
@@ -86,39 +191,177 @@ class GitCommit():
         dir : str
             Git repo saved directory
         """
-        cmd = f'git clone {self.url} {dir}'
-        _run_command(cmd)
+        opts = '--filter=blob:none ' if self.partial else ''
+        cmd = f'git clone {opts}{self.url} {dir}'
+        self._run_in(cmd)
+
+    def _sync_mirror(self, dir: str):
+        """ Create or update a bare clone of the git repo
 
-    def _filter_by_1st_line(self, commits: list, key: str, exist: bool = True):
-        """ Filter commits by the first line of their commit messages
+        Branches and tags are kept the same as in the remote repo, so
+        `--all` covers the same commits as in a fresh clone.
 
         Parameters
         ----------
-        commits : list
-            list of commits id
-        key : str
-            keyword to be filterd, ignore case
-        exist : bool, optional
-            leave the commits with keyword in their messages, by default True
-        """
-        key = key.lower()
-        wanted_commits = []
-        logger.info(f'Before filtering "{key}" with status {exist}, '
-                    f'{len(commits)} commits exist.')
-        for commit in commits:
-            cmd = f'git log --oneline {commit} --pretty=format:%s'
-            output = _run_command(cmd).split('\n')[0].lower()
-            if (key in output) == exist:
-                wanted_commits.append(commit)
-        logger.info(f'Now, {len(wanted_commits)} exist.')
-
-        return wanted_commits
+        dir : str
+            Git repo saved directory
+        """
+        if os.path.isdir(dir):
+            logger.info(f'Fetching new objects of {self.url} into {dir}')
+            self._run_in('git fetch --quiet --prune --tags origin', dir)
+            return
+        logger.info(f'Cloning {self.url} into {dir}')
+        os.makedirs(os.path.dirname(dir), exist_ok=True)
+        opts = '--filter=blob:none ' if self.partial else ''
+        self._run_in(f'git clone --quiet --bare {opts}{self.url} {dir}')
+        refspec = '+refs/heads/*:refs/heads/*'
+        self._run_in(f"git config remote.origin.fetch '{refspec}'", dir)
+
+    def _run_in(self, cmd: str, cwd: str = None) -> str:
+        """ run a command before the backend is set up
+        """
+        if self.profiler is None:
+            return run_command(cmd, cwd)
+        return self.profiler.call(cmd, run_command, cmd, cwd)
+
+    def _run(self, cmd: str, input: str = None) -> str:
+        """ run a command in the repo and return output
+        """
+        return self.backend.run(cmd, input)
+
+    def _stream(self, cmd: str) -> Iterator[str]:
+        """ run a command in the repo and yield its output piece by piece
+        """
+        return self.backend.stream(cmd)
+
+    def build_index(self) -> CommitIndex:
+        """ Build the commit index with a single streamed `git log`
+
+        Merge commits are diffed against their first parent, the same way
+        as `git diff {commit}^ {commit}` does.
+
+        Returns
+        -------
+        CommitIndex
+            index of all commits reachable from any ref
+        """
+        cmd = (
+            f'git --no-pager log --all -z --numstat '
+            f'--diff-merges=first-parent --format={LOG_FORMAT}'
+        )
+        index = CommitIndex(parse_log(self._stream(cmd)))
+        logger.info(f'Indexed {len(index)} commits.')
+        return index
+
+    def get_file_history(self) -> FileHistory:
+        """ Get the file history index, built on first use
+
+        One `git log --name-status -M` pass replaces the `git log --follow`
+        calls made for every changed file of every commit.
+
+        Returns
+        -------
+        FileHistory
+            per-path timelines of all commits reachable from any ref
+        """
+        with self._lock:
+            if self.history is None:
+                self.history = self._build_file_history()
+        return self.history
+
+    def _build_file_history(self) -> FileHistory:
+        cmd = (
+            f'git --no-pager log --all -z --topo-order --name-status -M '
+            f'--ignore-submodules --diff-merges=first-parent '
+            f'--format={HISTORY_FORMAT}'
+        )
+        history = FileHistory(parse_history(self._stream(cmd)),
+                              self.get_follow_source)
+        logger.info(f'Indexed history of {len(history.timelines)} files.')
+        return history
+
+    def get_author_index(self) -> AuthorIndex:
+        """ Get the author index, built on first use from the file history
+
+        Returns
+        -------
+        AuthorIndex
+            commits of every author
+        """
+        with self._lock:
+            if self.authors is None:
+                self.authors = AuthorIndex(self.get_file_history())
+        return self.authors
+
+    def get_subsys_index(self) -> SubsystemIndex:
+        """ Get the subsystem index, built on first use from the file
+        history
+
+        Returns
+        -------
+        SubsystemIndex
+            subsystems changed by every commit
+        """
+        with self._lock:
+            if self.subsystems is None:
+                self.subsystems = SubsystemIndex(self.get_file_history())
+        return self.subsystems
+
+    def get_follow_source(self, commit: str, fname: str) -> str:
+        """ Get where a file created by a commit comes from
+
+        `git log --follow` looks for the source of a new file among all
+        files of the parent commit, with this file as the only target of
+        rename and copy detection. Detecting the sources of all new files
+        of a commit at once may pair them differently, so the source of
+        every file is asked to git the same way as `--follow` does.
+
+        Parameters
+        ----------
+        commit : str
+            commit id
+        fname : str
+            file added or renamed by the commit
+
+        Returns
+        -------
+        str
+            source filename, None if git found none
+        """
+        key = (commit, fname)
+        if key not in self._follow_sources:
+            source = None
+            if not self.is_in_1st_commits(commit):
+                cmd = (
+                    f'git --no-pager log -z --follow -n 1 --name-status '
+                    f'--format= {commit} -- "{fname}"'
+                )
+                out = self._run(cmd).lstrip('\n')
+                for status, path, old in parse_name_status(out):
+                    if old is not None:
+                        source = old
+            self._follow_sources[key] = source
+        return self._follow_sources[key]
+
+    def _follow(self, commit: str, fname: str, skip: int = 0) -> list:
+        """ Get indexed commits which changed a file, None if unavailable
+        """
+        if not self.indexed:
+            return None
+        return self.get_file_history().follow(commit, fname, skip)
+
+    def _indexed(self, commit: str):
+        """ Get the indexed record of a commit, None if unavailable
+        """
+        if self.index is None:
+            return None
+        return self.index.get(commit)
 
     @staticmethod
     def standardize_commit_id(commit: Union[list, str]):
         if isinstance(commit, str):
-            return _std_commit(commit)
-        return [_std_commit(c) for c in commit]
+            return std_commit(commit)
+        return [std_commit(c) for c in commit]
 
     def get_log(self, commit: str = None) -> str:
         """ Collect raw git logs
@@ -137,7 +380,7 @@ class GitCommit():
             cmd = f'git --no-pager log --stat -1 {commit}'
         else:
             cmd = 'git --no-pager log --stat'
-        output = _run_command(cmd)
+        output = self._run(cmd)
 
         return output
 
@@ -152,6 +395,8 @@ class GitCommit():
         Returns:
             list: list of commit hash ids
         """
+        if key is None and self.index is not None:
+            return list(self.index.commits)
         if key is None:
             cmd = f'git log --all --pretty=format:%h --abbrev={COMMIT_LEN}'
         else:
@@ -159,33 +404,72 @@ class GitCommit():
                 f'git log --all -i --grep "{key}" '
                 f'--pretty=format:%h --abbrev={COMMIT_LEN}'
             )
-        commits = _run_command(cmd)
+        commits = self._run(cmd)
         commits = [c for c in commits.split('\n') if c]
         commits = self.standardize_commit_id(commits)
 
         return commits
 
+    def get_tips(self) -> dict:
+        """ Get the commits every ref of the repo points to
+
+        Returns
+        -------
+        dict
+            {ref name: full object id}
+        """
+        out = self._run('git for-each-ref --format="%(refname) %(objectname)"')
+        return dict(line.rsplit(' ', 1) for line in out.split('\n') if line)
+
+    def get_commits_since(self, tips: list) -> list:
+        """ Get commits which are reachable from the refs of the repo but not
+        from some earlier tips, i.e. `git rev-list --all ^tip...`
+
+        Tips which are no longer in the repo, e.g. after a force push, are
+        ignored. They are read by git from standard input, so any number
+        of refs fits.
+
+        Parameters
+        ----------
+        tips : list
+            object ids of the earlier tips
+
+        Returns
+        -------
+        list
+            commit ids, children first
+        """
+        excluded = ''.join(f'^{tip}\n' for tip in tips)
+        out = self._run('git rev-list --all --ignore-missing --stdin',
+                        excluded)
+        return self.standardize_commit_id([c for c in out.split('\n') if c])
+
     def get_author(self, commit: str) -> str:
+        rec = self._indexed(commit)
+        if rec is not None:
+            return rec.author
         cmd = f'git log --pretty=format:%an -n 1 {commit}'
-        out = _run_command(cmd)
+        out = self._run(cmd)
         return out
 
     def get_1st_commits(self) -> list:
         # commit repos have more than 1 root commit
         cmd = 'git rev-list --all --max-parents=0 HEAD'
-        output = _run_command(cmd)
+        output = self._run(cmd)
         commits = [c for c in output.split('\n') if c]
         return self.standardize_commit_id(commits)
 
     def is_in_1st_commits(self, commit: str) -> bool:
-        res = False
-        for c in self.init_commit:
-            len1, len2 = len(c), len(commit)
-            if len1 < len2:
-                res |= (c == commit[:len1])
-            else:
-                res |= (c[:len2] == commit)
-        return res
+        """ Whether a commit is a root commit, one of the ids being a
+        prefix of the other
+        """
+        for n, roots in self._roots.items():
+            if len(commit) >= n:
+                if commit[:n] in roots:
+                    return True
+            elif any(c.startswith(commit) for c in roots):
+                return True
+        return False
 
     def get_msg(self, commit: str) -> str:
         """Get commit messages
@@ -196,31 +480,131 @@ class GitCommit():
         Returns:
             str: messages
         """
+        rec = self._indexed(commit)
+        if rec is not None:
+            return rec.msg
         cmd = f'git log --format=%B -n 1 {commit}'
-        return _run_command(cmd)
+        return self._run(cmd)
 
     def get_diff(self, commit: str) -> str:
+        return ''.join(self.iter_diff(commit)).rstrip('\n')
+
+    def iter_diff(self,
+                  commit: str,
+                  limits: DiffLimits = None) -> Iterator[str]:
+        """ Stream the `git diff -U0` output of a commit file by file
+
+        Files matching an exclude pattern are left out by git. Files over
+        the line limit are found from the diff summary, and they and the
+        patches over the byte limit are dropped while streaming. Only one
+        patch is kept in memory at a time.
+
+        Parameters
+        ----------
+        commit : str
+            Commit hash id
+        limits : DiffLimits, optional
+            files to leave out, by default `diff_limits` of the repo
+
+        Yields
+        ------
+        str
+            patch of a changed file
+        """
         if self.is_in_1st_commits(commit):
-            return ''
-        cmd = f'git --no-pager diff -U0 {commit}^ {commit}'
-        output = _run_command(cmd)
-        return output
+            return
+        limits = limits or self.diff_limits
+        skip = set()
+        if limits.max_lines is not None:
+            for e in self.get_diff_summary(commit):
+                if (e.added or 0) + (e.deleted or 0) > limits.max_lines:
+                    skip.update(p for p in (e.path, e.old_path)
+                                if p is not None)
+        yield from self.backend.iter_diff(commit, limits.exclude,
+                                          limits.max_bytes, skip)
+
+    def classify_commits(self,
+                         fix_matchers: List[Callable] = None,
+                         merge_matchers: List[Callable] = None) -> tuple:
+        """ Find fix commits and merge commits in a single pass
+
+        Subjects, messages and parents are read from the commit index, or
+        from one streamed `git log` when the repo is not indexed.
+
+        Parameters
+        ----------
+        fix_matchers : List[Callable], optional
+            a commit is a fix commit if any of them returns True for its
+            CommitRecord, by default FIX_MATCHERS
+        merge_matchers : List[Callable], optional
+            a commit is a merge commit if any of them returns True, by
+            default MERGE_MATCHERS
+
+        Returns
+        -------
+        tuple
+            (fix commits, merge commits), lists of commit ids in log order
+        """
+        fix_matchers = fix_matchers or FIX_MATCHERS
+        merge_matchers = merge_matchers or MERGE_MATCHERS
+        if self.index is not None:
+            records = self.index.commits.values()
+        else:
+            cmd = f'git --no-pager log --all -z --format={LOG_FORMAT}'
+            records = parse_log(self._stream(cmd))
+
+        fix_commits, merge_commits = {}, {}
+        for rec in records:
+            commit = self.standardize_commit_id(rec.hash)
+            if any(match(rec) for match in merge_matchers):
+                merge_commits[commit] = None
+            elif any(match(rec) for match in fix_matchers):
+                fix_commits[commit] = None
+        logger.info(f'Found {len(fix_commits)} fix commits and '
+                    f'{len(merge_commits)} merge commits.')
+        return list(fix_commits), list(merge_commits)
 
     def get_fix_commits(self) -> list:
         """ Get commit ids related to bug fix
 
+        Merge commits are ignored since they lead to hundreds of changed
+        lines.
+
         Returns
         -------
         list
             List of commit ids
         """
-        fix_commits = self.get_commits('fix')
-        merge_commits = self.get_commits('merge')
-        # ignore merge commits which will lead to hundreds of changed lines
-        commits = set(fix_commits) - set(merge_commits)
+        fix_commits, _ = self.classify_commits()
+        return fix_commits
 
-        commits = self._filter_by_1st_line(list(commits), 'fix')
-        return commits
+    def _load_diff_summary(self, commit: str) -> tuple:
+        return self.backend.diff_summary(commit)
+
+    def get_diff_summary(self, commit: str) -> List[DiffEntry]:
+        """ Get status and line stats of every changed file in a commit
+
+        The summary of a commit is computed once by the backend. Results
+        are kept in an LRU cache of SUMMARY_CACHE_SIZE commits.
+
+        Parameters
+        ----------
+        commit : str
+            Commit hash id
+
+        Returns
+        -------
+        List[DiffEntry]
+            changed files, empty for initial commits
+        """
+        if self.is_in_1st_commits(commit):
+            return []
+        return list(self._summary(commit))
+
+    def diff_cache_info(self):
+        """ Get hits, misses and size of the diff summary cache
+        """
+        return self._summary.cache_info()
 
     def get_changed_filenames(self, commit: str, filter: str = None) -> list:
         """ Get changed files in a commit
@@ -231,26 +615,22 @@ class GitCommit():
             Commit hash id
 
         filter : str
-            Filter files. See `man git diff` for help
+            Filter files. Same as `--diff-filter` of `git diff`: upper case
+            status letters select files, lower case ones exclude them
 
         Returns
         -------
         list
             List of files.
         """
-        if self.is_in_1st_commits(commit):
-            return []
-
-        cmd = (
-            f'git --no-pager diff {commit}^ {commit} --name-only '
-            f'--ignore-submodules'
-        )
-        if filter is not None:
-            cmd += f' --diff-filter={filter}'
-        output = _run_command(cmd)
-        filenames = [f for f in output.split('\n') if f]
-
-        return filenames
+        entries = self.get_diff_summary(commit)
+        if filter is None:
+            return [e.path for e in entries]
+        include = {c for c in filter if c.isupper()}
+        exclude = {c.upper() for c in filter if c.islower()}
+        return [e.path for e in entries
+                if (not include or e.status in include)
+                and e.status not in exclude]
 
     def get_changed_lines(self, commit: str, fnames: list) -> dict:
         """ Get changed lines in a commit
@@ -269,8 +649,7 @@ class GitCommit():
         """
         fname_lines = defaultdict(list)
         for fname in fnames:
-            cmd = f'git --no-pager diff {commit}^ {commit} -U0 -- {fname}'
-            output = _run_command(cmd)
+            output = self.backend.diff_text(commit, fname)
             headers = [line for line in output.split('\n')
                        if re.match(r'^@@.+@@$', line)]
 
@@ -291,40 +670,73 @@ class GitCommit():
 
         return fname_lines
 
-    def blame_old_lines(self, commit: str, fname_lines: dict) -> dict:
+    def blame_lines(self, commit: str, fname: str, ranges: list) -> list:
+        """ Blame ranges of lines of a file with a single `git blame`
+
+        Parameters
+        ----------
+        commit : str
+            commit id
+        fname : str
+            file name
+        ranges : list
+            [(start, n_lines)]
+
+        Returns
+        -------
+        list
+            full commit ids, one for each blamed line
+        """
+        opts = ' '.join(f'-L{start},+{n}' for start, n in ranges)
+        cmd = (
+            f'git --no-pager blame --porcelain {opts} {commit} -- "{fname}"'
+        )
+        return parse_blame_porcelain(self._run(cmd))
+
+    def blame_old_lines(self,
+                        commit: str,
+                        fname_lines: dict,
+                        jobs: int = BLAME_JOBS) -> dict:
         """ Get commit hash ids for changed lines
 
+        All hunks of a file are blamed by one `git blame` call, and files
+        are blamed concurrently.
+
         Parameters
         ----------
         commit : str
             Current commit hash id
         fname_lines : dict
             Dictionary of file names and changed lines
+        jobs : int, optional
+            number of files blamed at the same time, by default BLAME_JOBS
 
         Returns
         -------
         dict
             {filename: bug_commits}
         """
-        bug_sets = defaultdict(set)
+        file_ranges = {}
         for fname, lines in fname_lines.items():
+            ranges = []
             for item in lines:
                 n = int(item[0][1])
                 # ignore unchanged commits
                 if (n <= 0):
                     continue
                 start = item[0][0][1:]  # ingore '-' signal
-                cmd = (
-                    f'git --no-pager blame -L{start},+{n} '
-                    f'--abbrev={COMMIT_LEN} {commit}^ -- {fname}'
-                )
-                output = _run_command(cmd)
-                lines = output.split('\n')
-                bug_sets[fname].update([line.split(' ')[0] for line in lines])
-
-        bug_commits = defaultdict(list)
-        for fname, commits in bug_sets.items():
-            bug_commits[fname] = self.standardize_commit_id(commits)
+                ranges.append((start, n))
+            if ranges:
+                file_ranges[fname] = ranges
+
+        def blame(fname):
+            return self.blame_lines(f'{commit}^', fname, file_ranges[fname])
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            results = pool.map(blame, file_ranges)
+            bug_commits = defaultdict(list)
+            for fname, commits in zip(file_ranges, results):
+                bug_commits[fname] = self.standardize_commit_id(set(commits))
         return bug_commits
 
     def get_numstat(self, commit: str) -> list:
@@ -338,40 +750,79 @@ class GitCommit():
         Returns
         -------
         list
-            [number of changed files, insertions, deletions]
+            [insertions, deletions]
         """
         if self.is_in_1st_commits(commit):
             return None
         res = [0, 0]
+        rec = self._indexed(commit)
+        if rec is not None:
+            for added, deleted, _ in rec.numstat:
+                if added is not None:
+                    res[0] += added
+                    res[1] += deleted
+            return res
         cmd = f'git diff --numstat {commit}^ {commit}'
-        out = _run_command(cmd)
+        out = self._run(cmd)
         for line in [line for line in out.split('\n') if line]:
-            cnt = re.match(r'^(\d+).+(\d+)', line)
+            cnt = re.match(r'^(\d+)\t(\d+)\t', line)
             if cnt is not None:
                 res[0] += int(cnt.group(1))
                 res[1] += int(cnt.group(2))
         return res
 
+    def get_added_lines(self, commit: str) -> dict:
+        """ Get the number of inserted lines of each changed file
+
+        Parameters
+        ----------
+        commit : str
+            commit id
+
+        Returns
+        -------
+        dict
+            {filename: inserted lines}, binary files are left out
+        """
+        rec = self._indexed(commit)
+        if rec is not None:
+            stats = [(added, path) for added, _, path in rec.numstat]
+        else:
+            stats = [(e.added, e.path) for e in self.get_diff_summary(commit)]
+        return {path: added for added, path in stats if added is not None}
+
+    def get_blob_stats(self, pairs: list) -> dict:
+        """ Get sizes and line counts of files in bulk
+
+        Files are read through the persistent `git cat-file --batch`
+        worker of this repo, or in-process with the pygit2 backend.
+
+        Parameters
+        ----------
+        pairs : list
+            [(commit, filename)]
+
+        Returns
+        -------
+        dict
+            {(commit, filename): (size, lines)}, None for missing files
+        """
+        return self.backend.blob_stats(pairs)
+
     def get_entropy(self, commit: str) -> float:
         if self.is_in_1st_commits(commit):
             return None
         ent = 0.0
         fnames = self.get_changed_filenames(commit, 'ad')
+        added_lines = self.get_added_lines(commit)
+        stats = self.get_blob_stats([(commit, fname) for fname in fnames])
         for fname in fnames:
-            # get total number of lines
-            cmd = f'git --no-pager show {commit}:"{fname}" | wc -l'
-            # out = _run_single_pipeline_commands([cmd, f'wc -l'])
-            out = _run_command(cmd)
-            cnt = int(out)
-
-            # get inserted lines
-            cmd = f'git diff --numstat {commit}^ {commit} -- "{fname}"'
-            out = _run_command(cmd)
-            added = re.search(r'\d+', out)
-            if added is None or cnt == 0:
+            stat = stats[(commit, fname)]
+            added = added_lines.get(fname)
+            if stat is None or added is None:
                 continue
-            added = int(added.group())
-            if added == cnt or added == 0:
+            cnt = stat[1]
+            if cnt == 0 or added == cnt or added == 0:
                 continue
             ent += -added/cnt*log2(added/cnt)
         return ent
@@ -384,11 +835,19 @@ class GitCommit():
         hset, anset = set(), set()
         fnames = self.get_changed_filenames(commit, filter='d')
         for fname in fnames:
+            entries = self._follow(commit, fname)
+            if entries is not None:
+                for rec in entries:
+                    h = self.standardize_commit_id(rec.hash)
+                    if h != commit:
+                        hset.add(h)
+                    anset.add(rec.author)
+                continue
             cmd = (
                 f'git --no-pager log --pretty=format:%h,%an '
                 f'--abbrev={COMMIT_LEN} --follow {commit} -- "{fname}"'
             )
-            out = _run_command(cmd)
+            out = self._run(cmd)
             lines = [line for line in out.split('\n') if line]
             for line in lines:
                 line = line.split(',')
@@ -421,10 +880,17 @@ class GitCommit():
         float
             unix timestamp
         """
+        rec = self._indexed(commit)
+        if rec is not None and fname is None and skip == 0:
+            return rec.time
+        if fname is not None:
+            entries = self._follow(commit, fname, skip)
+            if entries is not None:
+                return entries[0].time if entries else None
         cmd = f'git log --pretty=format:%at -n 1 --skip {skip} {commit}'
         if fname is not None:
             cmd += f' --follow -- "{fname}"'
-        out = _run_command(cmd)
+        out = self._run(cmd)
         if out is None or len(out) == 0:
             return None
         return float(out)
@@ -451,25 +917,39 @@ class GitCommit():
         """Get commits made by the same author before
         """
         author = self.get_author(commit)
+        if self.indexed:
+            commits = self.get_author_index().exp(commit, author)
+            if commits is not None:
+                return commits
         cmd = (
             f'git --no-pager log --author "{author}" --abbrev={COMMIT_LEN} '
             f'--pretty=format:%h {commit}^'
         )
-        out = _run_command(cmd)
+        out = self._run(cmd)
         out = [c for c in out.split('\n') if c]
         out = self.standardize_commit_id(out)
         return set(out)
 
     def get_author_recent_exp(self, commit: str):
+        x = self.get_author_time(commit)
+        if self.indexed:
+            author = self.get_author(commit)
+            rexp = self.get_author_index().recent_exp(commit, author, x)
+            if rexp is not None:
+                return rexp
         commits = self.get_author_exp(commit)
         rexp = 0.0
-        x = self.get_author_time(commit)
         for c in commits:
             t = self.get_author_time(c)
             rexp += 1.0 / (1 + (x-t)/24/7)
         return rexp
 
     def get_author_subssys_exp(self, commit: str):
+        if self.indexed:
+            author = self.get_author(commit)
+            positions = self.get_author_index().prior(commit, author)
+            if positions is not None:
+                return self.get_subsys_index().count(commit, positions)
         commits = self.get_author_exp(commit)
         fnames = self.get_changed_filenames(commit, 'rd')
         subs0 = get_subsys(fnames)
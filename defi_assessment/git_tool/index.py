@@ -0,0 +1,716 @@
+"""Commit indexes built from single streamed `git log` passes.
+
+`GitCommit` used to spawn one process per commit and per query. The
+indexes keep what those queries need (author, author time, message,
+parents, per-file line stats and file histories) in memory, so they can be
+answered with lookups.
+"""
+import re
+import heapq
+import numpy as np
+from bisect import bisect_left
+from collections import namedtuple, defaultdict
+from typing import Iterable, Iterator, Callable
+from .parser import std_commit, get_subsys
+
+__all__ = ['LOG_FORMAT', 'HISTORY_FORMAT', 'CommitRecord', 'HistoryRecord',
+           'DiffEntry', 'CommitIndex', 'CommitGraph', 'FileHistory',
+           'AuthorIndex', 'SubsystemIndex', 'parse_log', 'parse_history',
+           'parse_numstat', 'parse_name_status', 'parse_diff_summary',
+           'compile_basic_regex']
+
+RECORD_SEP = '\x1e'
+FIELD_SEP = '\x1f'
+
+# Used with `git log -z --numstat`. Each record starts with RECORD_SEP and
+# its header ends with FIELD_SEP followed by the NUL added by `-z`.
+LOG_FORMAT = '%x1e%H%x1f%an%x1f%at%x1f%P%x1f%s%x1f%B%x1f'
+# Used with `git log -z --topo-order --name-status -M`
+HISTORY_FORMAT = '%x1e%H%x1f%an%x1f%ae%x1f%at%x1f%ct%x1f%P%x1f'
+
+CommitRecord = namedtuple(
+    'CommitRecord',
+    ['hash', 'author', 'time', 'parents', 'subject', 'msg', 'numstat']
+)
+HistoryRecord = namedtuple(
+    'HistoryRecord',
+    ['hash', 'author', 'email', 'time', 'ctime', 'parents', 'changes']
+)
+DiffEntry = namedtuple(
+    'DiffEntry', ['status', 'path', 'old_path', 'added', 'deleted']
+)
+
+# POSIX character classes of bracket expressions, e.g. `[[:digit:]]`
+POSIX_CLASSES = {
+    'alpha': 'a-zA-Z', 'digit': '0-9', 'alnum': 'a-zA-Z0-9',
+    'upper': 'A-Z', 'lower': 'a-z', 'xdigit': '0-9A-Fa-f',
+    'space': ' \\t\\n\\r\\f\\v', 'blank': ' \\t',
+    'cntrl': '\\x00-\\x1f\\x7f', 'print': '\\x20-\\x7e',
+    'graph': '\\x21-\\x7e',
+    'punct': re.escape('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'),
+}
+# escapes of GNU basic regular expressions which are the same in Python
+BRE_ESCAPES = {'(': '(', ')': ')', '{': '{', '}': '}', '|': '|', '+': '+',
+               '?': '?', '<': r'\b', '>': r'\b', 'b': r'\b', 'B': r'\B',
+               'w': r'\w', 'W': r'\W', 's': r'\s', 'S': r'\S'}
+
+
+def parse_numstat(txt: str) -> list:
+    """ Parse NUL separated output of `--numstat -z`
+
+    Parameters
+    ----------
+    txt : str
+        numstat part of a single log record
+
+    Returns
+    -------
+    list
+        [(added, deleted, path)], added and deleted are None for binary files
+    """
+    stats = []
+    tokens = txt.lstrip('\n').split('\0')
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        if not token:
+            continue
+        added, deleted, path = token.split('\t', 2)
+        if not path:
+            # renamed or copied file: `added\tdeleted\t\0old\0new\0`
+            path = tokens[i + 1]
+            i += 2
+        added = int(added) if added != '-' else None
+        deleted = int(deleted) if deleted != '-' else None
+        stats.append((added, deleted, path))
+    return stats
+
+
+def parse_name_status(txt: str) -> list:
+    """ Parse NUL separated output of `--name-status -z`
+
+    Parameters
+    ----------
+    txt : str
+        name-status part of a single log record
+
+    Returns
+    -------
+    list
+        [(status, path, old_path)], old_path is None unless the file is
+        renamed or copied
+    """
+    changes = []
+    tokens = txt.lstrip('\n').split('\0')
+    i = 0
+    while i < len(tokens):
+        status = tokens[i]
+        i += 1
+        if not status:
+            continue
+        if status[0] in 'RC':
+            old, path = tokens[i], tokens[i + 1]
+            i += 2
+        else:
+            old, path = None, tokens[i]
+            i += 1
+        changes.append((status[0], path, old))
+    return changes
+
+
+def parse_diff_summary(txt: str) -> tuple:
+    """ Parse NUL separated output of `git diff --raw --numstat -z`
+
+    Parameters
+    ----------
+    txt : str
+        output of the diff
+
+    Returns
+    -------
+    tuple
+        (DiffEntry), in the order of the diff. added and deleted are None
+        for binary files
+    """
+    tokens = txt.split('\0')
+    entries, stats = [], {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        if not token:
+            continue
+        if token[0] == ':':
+            # `:<modes> <blobs> <status>\0<path>\0[<new path>\0]`
+            status = token.split()[-1][0]
+            if status in 'RC':
+                old, path = tokens[i], tokens[i + 1]
+                i += 2
+            else:
+                old, path = None, tokens[i]
+                i += 1
+            entries.append((status, path, old))
+            continue
+        added, deleted, path = token.split('\t', 2)
+        if not path:
+            path = tokens[i + 1]
+            i += 2
+        stats[path] = (int(added) if added != '-' else None,
+                       int(deleted) if deleted != '-' else None)
+    return tuple(DiffEntry(status, path, old, *stats.get(path, (None, None)))
+                 for status, path, old in entries)
+
+
+def _parse_record(rec: str) -> CommitRecord:
+    head, _, stat = rec.partition(FIELD_SEP + '\0')
+    h, author, time, parents, subject, msg = head.split(FIELD_SEP, 5)
+    return CommitRecord(
+        hash=h,
+        author=author,
+        time=float(time),
+        parents=[std_commit(p) for p in parents.split()],
+        subject=subject,
+        msg=msg.rstrip('\n'),
+        numstat=parse_numstat(stat)
+    )
+
+
+def _parse_history_record(rec: str) -> HistoryRecord:
+    head, _, changes = rec.partition(FIELD_SEP + '\0')
+    h, author, email, time, ctime, parents = head.split(FIELD_SEP, 5)
+    return HistoryRecord(
+        hash=h,
+        author=author,
+        email=email,
+        time=float(time),
+        ctime=float(ctime),
+        parents=[std_commit(p) for p in parents.split()],
+        changes=parse_name_status(changes)
+    )
+
+
+def _split_records(chunks: Iterable[str]) -> Iterator[str]:
+    """ Split streamed log output into records
+
+    Only one record is buffered at a time, so the whole log never has to
+    be held as a single string.
+    """
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        if RECORD_SEP not in chunk:
+            continue
+        *records, buf = buf.split(RECORD_SEP)
+        for rec in records:
+            if rec:
+                yield rec
+    if buf:
+        yield buf
+
+
+def parse_log(chunks: Iterable[str]) -> Iterator[CommitRecord]:
+    """ Parse streamed output of `git log -z --numstat --format=LOG_FORMAT`
+
+    Parameters
+    ----------
+    chunks : Iterable[str]
+        pieces of the log output in order
+
+    Yields
+    ------
+    CommitRecord
+        parsed commits, in log order
+    """
+    for rec in _split_records(chunks):
+        yield _parse_record(rec)
+
+
+def parse_history(chunks: Iterable[str]) -> Iterator[HistoryRecord]:
+    """ Parse streamed output of
+    `git log -z --name-status -M --format=HISTORY_FORMAT`
+
+    Parameters
+    ----------
+    chunks : Iterable[str]
+        pieces of the log output in order
+
+    Yields
+    ------
+    HistoryRecord
+        parsed commits, in log order
+    """
+    for rec in _split_records(chunks):
+        yield _parse_history_record(rec)
+
+
+class CommitIndex():
+    """In-memory table of commits keyed by standardized commit id
+    """
+    def __init__(self, records: Iterable[CommitRecord]):
+        self.commits = {}
+        for rec in records:
+            self.commits.setdefault(std_commit(rec.hash), rec)
+
+    def __len__(self):
+        return len(self.commits)
+
+    def __contains__(self, commit: str):
+        return std_commit(commit) in self.commits
+
+    def get(self, commit: str) -> CommitRecord:
+        """ Get the record of a commit
+
+        Parameters
+        ----------
+        commit : str
+            commit id, in any length
+
+        Returns
+        -------
+        CommitRecord
+            record of the commit, None if the commit is not indexed
+        """
+        return self.commits.get(std_commit(commit))
+
+
+class CommitGraph():
+    """Ancestry of commits
+
+    Every commit gets a topological position, parents always before their
+    children. Commits are split into chains, each commit following its
+    first parent unless a sibling did so first. Only merges and the first
+    commit of every chain keep their ancestors, as a bitset over positions.
+    The ancestors of any other commit are the ones of the nearest such
+    commit of its chain plus the commits of the chain in between. A history
+    without merges keeps a bitset per branch, and one without branches
+    keeps none.
+    """
+    def __init__(self, commits: list, parents: dict):
+        """
+        Parameters
+        ----------
+        commits : list
+            standardized commit ids in topological order, children first
+        parents : dict
+            {commit: [parent commits]}
+        """
+        n = len(commits)
+        self.pos = {c: n - 1 - i for i, c in enumerate(commits)}
+        self.commits = commits[::-1]
+        # positions of the commits of every chain, oldest first
+        self.chains = []
+        # chain, index in the chain and nearest commit with a bitset
+        self.chain, self.depth, self.base = [], [], []
+        # {position: bitset of the ancestors}
+        self.bits = {}
+        for i, commit in enumerate(self.commits):
+            ps = [self.pos[p] for p in parents.get(commit, [])
+                  if p in self.pos]
+            first = ps[0] if ps else None
+            if first is not None and self.chains[self.chain[first]][-1] \
+                    == first:
+                k = self.chain[first]
+                self.chains[k].append(i)
+            else:
+                k = len(self.chains)
+                self.chains.append([i])
+            self.chain.append(k)
+            self.depth.append(len(self.chains[k]) - 1)
+            if len(ps) > 1 or self.depth[i] == 0:
+                bits = 1 << i
+                for p in ps:
+                    bits |= self._ancestor_bits(p)
+                self.bits[i] = bits
+                self.base.append(i)
+            else:
+                self.base.append(self.base[first])
+        self.chains = [np.array(chain, dtype=np.int64)
+                       for chain in self.chains]
+        self.linear = len(self.chains) <= 1
+
+    def __len__(self):
+        return len(self.commits)
+
+    def __contains__(self, commit: str):
+        return std_commit(commit) in self.pos
+
+    def _segment(self, i: int):
+        """ Get the positions of the commits of a chain from the one after
+        the nearest commit with a bitset to the one at position `i`
+        """
+        start = self.depth[self.base[i]] + 1
+        return self.chains[self.chain[i]][start:self.depth[i] + 1]
+
+    def _ancestor_bits(self, i: int) -> int:
+        bits = self.bits[self.base[i]]
+        segment = self._segment(i)
+        if len(segment):
+            mask = np.zeros(segment[-1] + 1, dtype=bool)
+            mask[segment] = True
+            buf = np.packbits(mask, bitorder='little').tobytes()
+            bits |= int.from_bytes(buf, 'little')
+        return bits
+
+    def ancestor_mask(self, commit: str) -> np.ndarray:
+        """ Get the ancestors of a commit as a boolean array over positions
+        """
+        i = self.pos[std_commit(commit)]
+        n = len(self.commits)
+        buf = self.bits[self.base[i]].to_bytes((n + 7) // 8, 'little')
+        mask = np.unpackbits(np.frombuffer(buf, dtype=np.uint8),
+                             bitorder='little')[:n].astype(bool)
+        mask[self._segment(i)] = True
+        return mask
+
+    def reaches(self, i: int, j: int) -> bool:
+        """ Check if the commit at position `j` is an ancestor of the one at
+        position `i`, or the same commit
+        """
+        if j > i:
+            return False
+        base = self.base[i]
+        if (self.chain[j] == self.chain[i]
+                and self.depth[base] < self.depth[j] <= self.depth[i]):
+            return True
+        return bool((self.bits[base] >> j) & 1)
+
+    def is_ancestor(self, ancestor: str, commit: str) -> bool:
+        """ Check if a commit is reachable from another one
+        """
+        return self.reaches(self.pos[std_commit(commit)],
+                            self.pos[std_commit(ancestor)])
+
+
+class FileHistory():
+    """Per-path timelines of the changes made by non-merge commits
+
+    Renames are recorded with the old path, so the history of a file can
+    be followed the same way as `git log --follow` does.
+    """
+    def __init__(self,
+                 records: Iterable[HistoryRecord],
+                 sources: Callable[[str, str], str] = None):
+        """
+        Parameters
+        ----------
+        records : Iterable[HistoryRecord]
+            commits in topological order, children first
+        sources : Callable[[str, str], str], optional
+            get the source path of a file created by a commit, as found by
+            `git log --follow`, from the commit and the path. By default,
+            only the renames found by `-M` are followed.
+        """
+        self.sources = sources
+        self.commits = {}
+        for rec in records:
+            self.commits.setdefault(std_commit(rec.hash), rec)
+        keys = list(self.commits)
+        self.graph = CommitGraph(
+            keys, {k: rec.parents for k, rec in self.commits.items()}
+        )
+
+        # {path: [(position, status, old_path, commit)]}, oldest first
+        self.timelines = defaultdict(list)
+        for key in self.graph.commits:
+            rec = self.commits[key]
+            # merges are not listed by `git log -- <path>` as long as they
+            # take the file from one of their parents
+            if len(rec.parents) > 1:
+                continue
+            pos = self.graph.pos[key]
+            for status, path, old in rec.changes:
+                self.timelines[path].append((pos, status, old, key))
+                if status == 'R':
+                    # the file is deleted under its old name
+                    self.timelines[old].append((pos, 'D', None, key))
+        self._positions = {path: [e[0] for e in entries]
+                           for path, entries in self.timelines.items()}
+
+    def __contains__(self, commit: str):
+        return std_commit(commit) in self.commits
+
+    def _walk(self, commit: str, n: int) -> list:
+        """ Get the first `n` commits `git log {commit}` walks through
+        """
+        heap = [(-self.commits[commit].ctime, -self.graph.pos[commit],
+                 commit)]
+        seen = {commit}
+        walked = []
+        while heap and len(walked) < n:
+            _, _, key = heapq.heappop(heap)
+            walked.append(key)
+            for p in self.commits[key].parents:
+                if p in self.commits and p not in seen:
+                    seen.add(p)
+                    heapq.heappush(
+                        heap, (-self.commits[p].ctime, -self.graph.pos[p], p)
+                    )
+        return walked
+
+    def follow(self, commit: str, fname: str, skip: int = 0) -> list:
+        """ Get commits which changed a file, following renames
+
+        Same as `git log --follow --skip {skip} {commit} -- {fname}`.
+        Paths can not be used to prune the walk when renames are followed,
+        so git counts every walked commit for `--skip`, whether it changed
+        the file or not. Renames made by skipped commits are not followed.
+
+        Parameters
+        ----------
+        commit : str
+            commit id to start from
+        fname : str
+            file name in `commit`
+        skip : int, optional
+            number of walked commits to skip, by default 0
+
+        Returns
+        -------
+        list
+            [HistoryRecord], newest first. None if `commit` is unknown
+        """
+        commit = std_commit(commit)
+        if commit not in self.graph.pos:
+            return None
+        skipped = set(self._walk(commit, skip)) if skip > 0 else set()
+        limit = self.graph.pos[commit] + 1
+        found = []
+        path = fname
+        while path is not None:
+            entries = self.timelines.get(path, [])
+            i = bisect_left(self._positions.get(path, []), limit)
+            nxt = None
+            for pos, status, old, key in reversed(entries[:i]):
+                if not self.graph.linear and not self.graph.reaches(
+                        self.graph.pos[commit], pos):
+                    continue
+                if key in skipped:
+                    continue
+                found.append(key)
+                if status in 'AR':
+                    # older changes were made to the file under its old name
+                    if self.sources is not None:
+                        old = self.sources(key, path)
+                    if old is not None:
+                        nxt, limit = old, pos
+                        break
+            path = nxt
+        # `git log` shows commits in reverse chronological order
+        found.sort(key=lambda k: (self.commits[k].ctime, self.graph.pos[k]),
+                   reverse=True)
+        return [self.commits[k] for k in found]
+
+
+def _bracket(pattern: str, i: int) -> tuple:
+    """ Translate the bracket expression starting at `pattern[i]`, which is
+    `[`, and find where it ends
+    """
+    j = i + 1
+    out = ['[']
+    if j < len(pattern) and pattern[j] == '^':
+        out.append('^')
+        j += 1
+    first = True
+    while j < len(pattern) and (first or pattern[j] != ']'):
+        m = re.match(r'\[:(\w+):\]', pattern[j:])
+        if m is not None and m.group(1) in POSIX_CLASSES:
+            out.append(POSIX_CLASSES[m.group(1)])
+            j += m.end()
+        else:
+            c = pattern[j]
+            # backslashes are not special in brackets
+            out.append('\\' + c if c in '\\[]&~|' else c)
+            j += 1
+        first = False
+    if j >= len(pattern):
+        raise re.error('unmatched [', pattern, i)
+    out.append(']')
+    return ''.join(out), j + 1
+
+
+def compile_basic_regex(pattern: str) -> re.Pattern:
+    """ Compile a basic regular expression of GNU grep, the default of
+    `git log --author` and `--grep`, e.g. `J. Doe` or `dependabot[bot]`
+
+    `+ ? | ( ) { }` are literal unless escaped, `*` and `^` are literal at
+    the start and `$` is literal before the end, brackets are character
+    classes.
+
+    Parameters
+    ----------
+    pattern : str
+        basic regular expression
+
+    Returns
+    -------
+    re.Pattern
+        the same expression for `re`
+    """
+    out = []
+    i = 0
+    # whether a `*` or `^` here would start an expression
+    start = True
+    while i < len(pattern):
+        c = pattern[i]
+        at_start, start = start, False
+        if c == '\\':
+            if i + 1 == len(pattern):
+                raise re.error('trailing backslash', pattern, i)
+            c = pattern[i + 1]
+            i += 2
+            if c in BRE_ESCAPES:
+                out.append(BRE_ESCAPES[c])
+                start = c in '(|'
+            elif c.isdigit():
+                out.append('\\' + c)
+            else:
+                out.append(re.escape(c))
+            continue
+        if c == '[':
+            part, i = _bracket(pattern, i)
+            out.append(part)
+            continue
+        if c == '^' and at_start:
+            out.append('^')
+            start = True
+        elif c == '$' and (i + 1 == len(pattern)
+                           or pattern[i + 1:i + 3] in ('\\)', '\\|')):
+            out.append('$')
+        elif c == '*' and not at_start:
+            out.append('*')
+        elif c == '.':
+            out.append('.')
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(out))
+
+
+class AuthorIndex():
+    """Commits and author times of every author, in topological order
+
+    Authors are matched the same way as `git log --author`, i.e. by
+    searching the author name as a basic regular expression in
+    `name <email>` of every commit.
+    """
+    def __init__(self, history: FileHistory):
+        self.graph = history.graph
+        recs = [history.commits[c] for c in self.graph.commits]
+        self.idents = [f'{rec.author} <{rec.email}>' for rec in recs]
+        self.times = np.array([rec.time for rec in recs], dtype=float)
+        self.parents = {c: rec.parents
+                        for c, rec in zip(self.graph.commits, recs)}
+        self._commits = {}
+
+    def commits_of(self, author: str) -> np.ndarray:
+        """ Get sorted positions of the commits made by an author
+        """
+        if author not in self._commits:
+            pat = compile_basic_regex(author)
+            positions = [i for i, ident in enumerate(self.idents)
+                         if pat.search(ident)]
+            self._commits[author] = np.array(positions, dtype=np.int64)
+        return self._commits[author]
+
+    def prior(self, commit: str, author: str) -> np.ndarray:
+        """ Get commits made by an author before a commit
+
+        Same as `git log --author {author} {commit}^`.
+
+        Parameters
+        ----------
+        commit : str
+            commit id
+        author : str
+            author name
+
+        Returns
+        -------
+        np.ndarray
+            positions of the commits, None if `commit` is unknown
+        """
+        commit = std_commit(commit)
+        if commit not in self.graph.pos:
+            return None
+        parents = self.parents[commit]
+        if not parents or parents[0] not in self.graph.pos:
+            return np.array([], dtype=np.int64)
+        parent = parents[0]
+        positions = self.commits_of(author)
+        i = np.searchsorted(positions, self.graph.pos[parent], side='right')
+        positions = positions[:i]
+        if not self.graph.linear:
+            positions = positions[self.graph.ancestor_mask(parent)[positions]]
+        return positions
+
+    def exp(self, commit: str, author: str) -> set:
+        """ Get ids of the commits made by an author before a commit
+        """
+        positions = self.prior(commit, author)
+        if positions is None:
+            return None
+        return {self.graph.commits[i] for i in positions}
+
+    def recent_exp(self, commit: str, author: str, time: float) -> float:
+        """ Sum of 1 / (1 + age) over the commits made by an author before a
+        commit, age in units of a week of hours
+        """
+        positions = self.prior(commit, author)
+        if positions is None:
+            return None
+        return float(np.sum(1.0 / (1 + (time - self.times[positions])/24/7)))
+
+
+class SubsystemIndex():
+    """Top-level subsystems changed by every commit, as integer bitmasks
+
+    Subsystems are the ones of `parser.get_subsys`. Each commit gets two
+    masks over its diff against the first parent: `touched` for the files
+    it adds or modifies (diff filter `rd`) and `modified` for the existing
+    files it modifies or renames (diff filter `ad`).
+    """
+    def __init__(self, history: FileHistory):
+        self.graph = history.graph
+        self.bits = {}
+        touched, modified = [], []
+        for c in self.graph.commits:
+            rec = history.commits[c]
+            changes = rec.changes if rec.parents else []
+            touched.append(self.mask(path for status, path, _ in changes
+                                     if status not in 'RD'))
+            modified.append(self.mask(path for status, path, _ in changes
+                                      if status not in 'AD'))
+        dtype = np.uint64 if len(self.bits) <= 64 else object
+        self.touched = np.array(touched, dtype=dtype)
+        self.modified = np.array(modified, dtype=dtype)
+
+    def mask(self, fnames: Iterable[str]) -> int:
+        """ Get the bitmask of the subsystems of some files
+        """
+        mask = 0
+        for sub in get_subsys(fnames):
+            mask |= 1 << self.bits.setdefault(sub, len(self.bits))
+        return mask
+
+    def count(self, commit: str, positions: np.ndarray) -> int:
+        """ Count commits modifying a subsystem touched by a commit
+
+        Parameters
+        ----------
+        commit : str
+            commit id
+        positions : np.ndarray
+            positions of the earlier commits, see `AuthorIndex.prior`
+
+        Returns
+        -------
+        int
+            number of the earlier commits sharing a subsystem, None if
+            `commit` is unknown
+        """
+        pos = self.graph.pos.get(std_commit(commit))
+        if pos is None:
+            return None
+        shared = self.modified[positions] & self.touched[pos]
+        return int(np.count_nonzero(shared))
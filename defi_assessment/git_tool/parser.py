@@ -1,6 +1,32 @@
+import re
+from fnmatch import fnmatchcase
 from pathlib import Path
+from typing import Iterable, Iterator
 
-__all__ = ['get_subsys', 'get_dir']
+__all__ = ['get_subsys', 'get_dir', 'std_commit', 'parse_blame_porcelain',
+           'patch_paths', 'match_pathspec', 'split_patches']
+
+# header of a line group in `git blame --porcelain` output:
+# <sha> <line in original file> <line in final file> [<lines in group>]
+BLAME_HEADER = re.compile(r'^([0-9a-f]{40}) \d+ \d+( \d+)?$')
+# first line of a patch, paths with special characters are C-quoted:
+# diff --git a/<old path> b/<new path>
+PATCH_HEADER = re.compile(r'^diff --git (?:"((?:[^"\\]|\\.)*)"|(.*?)) '
+                          r'(?:"((?:[^"\\]|\\.)*)"|(.*))$')
+
+
+def std_commit(commit: str) -> str:
+    """ standardize a single commit id
+
+    Args:
+        commit (str): commit id
+
+    Returns:
+        str: standardized commit id
+    """
+    commit = re.sub(r'\W+', '', commit)
+    commit = commit[:8]
+    return commit
 
 
 def get_subsys(fnames: list) -> int:
@@ -24,3 +50,137 @@ def get_dir(fnames: list) -> int:
         p = Path(fname)
         dir.add(p.parent)
     return dir
+
+
+def parse_blame_porcelain(txt: str) -> list:
+    """ Get the commit of every line from `git blame --porcelain` output
+
+    Parameters
+    ----------
+    txt : str
+        output of `git blame --porcelain`
+
+    Returns
+    -------
+    list
+        full commit ids, one for each blamed line
+    """
+    commits = []
+    for line in txt.split('\n'):
+        # content lines start with a tab and are never headers
+        m = BLAME_HEADER.match(line)
+        if m is not None:
+            commits.append(m.group(1))
+    return commits
+
+
+def _iter_lines(chunks: Iterable[str], limit: int = None) -> Iterator[str]:
+    """ Join streamed output into lines ending with LF
+
+    Lines longer than `limit` are cut in the middle, so a single huge line
+    is never kept in memory.
+    """
+    rest = ''
+    for chunk in chunks:
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + '\n'
+        if limit is not None and len(rest) > limit:
+            rest = rest[:limit + 1]
+    if rest:
+        yield rest
+
+
+def _unquote(path: str) -> str:
+    """ Decode a path C-quoted by git, escapes are of UTF-8 bytes
+    """
+    return path.encode('latin-1', 'backslashreplace') \
+        .decode('unicode_escape').encode('latin-1').decode('utf-8', 'replace')
+
+
+def patch_paths(header: str) -> tuple:
+    """ Get the old and new path of a file from the `diff --git` line of
+    its patch
+
+    Parameters
+    ----------
+    header : str
+        first line of the patch
+
+    Returns
+    -------
+    tuple
+        (old path, new path), None if the line is not a patch header
+    """
+    header = header.rstrip('\n')
+    m = PATCH_HEADER.match(header)
+    if m is None:
+        return None
+    old_q, old, new_q, new = m.groups()
+    if old_q is None and new_q is None:
+        # the paths of an unchanged name split the line in halves, which
+        # also holds when a path has ' b/' in it
+        rest = header[len('diff --git '):]
+        half = (len(rest) - 1) // 2
+        if rest[:half][2:] == rest[half + 1:][2:]:
+            old, new = rest[:half], rest[half + 1:]
+    old = _unquote(old_q) if old_q is not None else old
+    new = _unquote(new_q) if new_q is not None else new
+    return old[2:], new[2:]
+
+
+def match_pathspec(path: str, pattern: str) -> bool:
+    """ Whether a path matches a pathspec of git without magic: the
+    pattern is the path, one of its directories, or matches it as a
+    wildcard where `*` also matches `/`
+    """
+    return (path == pattern
+            or path.startswith(pattern.rstrip('/') + '/')
+            or fnmatchcase(path, pattern))
+
+
+def split_patches(chunks: Iterable[str],
+                  max_bytes: int = None,
+                  skip: Iterable[str] = ()) -> Iterator[str]:
+    """ Split streamed `git diff` output into the patches of single files
+
+    Only the patch being read is kept in memory. A patch is dropped as soon
+    as it grows over `max_bytes`, and the rest of it is skipped. Patches of
+    files in `skip` are skipped from their `diff --git` line on.
+
+    Parameters
+    ----------
+    chunks : Iterable[str]
+        pieces of `git diff` output
+    max_bytes : int, optional
+        largest patch in bytes of UTF-8, by default None for no limit
+    skip : Iterable[str], optional
+        paths of files to leave out. A renamed file is left out if either
+        of its paths is given
+
+    Yields
+    ------
+    str
+        patch of a file, starting with `diff --git`
+    """
+    skip = set(skip)
+    patch, size, dropped = [], 0, False
+    for line in _iter_lines(chunks, max_bytes):
+        if line.startswith('diff --git '):
+            if patch:
+                yield ''.join(patch)
+            patch, size, dropped = [], 0, False
+            if skip:
+                paths = patch_paths(line)
+                dropped = paths is not None and not skip.isdisjoint(paths)
+        if dropped:
+            continue
+        if max_bytes is not None:
+            size += len(line.encode('utf-8'))
+            if size > max_bytes:
+                patch, dropped = [], True
+                continue
+        patch.append(line)
+    if patch:
+        yield ''.join(patch)
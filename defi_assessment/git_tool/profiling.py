@@ -0,0 +1,149 @@
+"""Opt-in profiling of the git commands run by `GitCommit`.
+
+Every command is recorded under the `GitCommit` method which asked for it,
+so the cost of a feature can be told apart from the others. A method is
+the outermost public method of the profiled object on the call stack,
+e.g. `get_entropy` rather than the `get_diff_summary` it calls.
+"""
+import sys
+import time
+import threading
+from collections import defaultdict
+from typing import Callable, Iterable, Iterator
+
+__all__ = ['Profiler', 'command_name']
+
+
+def command_name(cmd: str) -> str:
+    """ Get the name of a command without its options and arguments
+
+    Parameters
+    ----------
+    cmd : str
+        command line, e.g. `git --no-pager diff -U0 a^ a`
+
+    Returns
+    -------
+    str
+        program and subcommand, e.g. `git diff`
+    """
+    tokens = cmd.split()
+    if not tokens:
+        return ''
+    for token in tokens[1:]:
+        if not token.startswith('-'):
+            return f'{tokens[0]} {token}'
+    return tokens[0]
+
+
+def _size(out) -> int:
+    if isinstance(out, str):
+        return len(out.encode('utf-8', errors='replace'))
+    if isinstance(out, bytes):
+        return len(out)
+    return 0
+
+
+class Profiler():
+    """Calls, wall time and output bytes of commands, per method and
+    command
+    """
+    def __init__(self, owner: object):
+        """
+        Parameters
+        ----------
+        owner : object
+            object whose methods the commands are recorded under
+        """
+        self.owner = owner
+        # {(method, command): [calls, seconds, bytes]}
+        self.stats = defaultdict(lambda: [0, 0.0, 0])
+        self._lock = threading.Lock()
+
+    def _method(self) -> str:
+        public, private = None, None
+        frame = sys._getframe(1)
+        while frame is not None:
+            name = frame.f_code.co_name
+            method = getattr(type(self.owner), name, None)
+            if (getattr(method, '__code__', None) is frame.f_code
+                    and frame.f_locals.get('self') is self.owner):
+                if name.startswith('_'):
+                    private = name
+                else:
+                    public = name
+            frame = frame.f_back
+        return public or private or '-'
+
+    def add(self, command: str, seconds: float, nbytes: int = 0):
+        """ Record a finished command
+
+        Parameters
+        ----------
+        command : str
+            command line or name
+        seconds : float
+            wall time
+        nbytes : int, optional
+            size of the output, by default 0
+        """
+        key = (self._method(), command_name(command))
+        with self._lock:
+            stat = self.stats[key]
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] += nbytes
+
+    def call(self, command: str, fn: Callable, *args):
+        """ Run `fn(*args)` and record it as `command`
+        """
+        start = time.perf_counter()
+        out = fn(*args)
+        self.add(command, time.perf_counter() - start, _size(out))
+        return out
+
+    def stream(self, command: str, chunks: Iterable) -> Iterator:
+        """ Pass output chunks through and record the command once they
+        are exhausted
+        """
+        start = time.perf_counter()
+        nbytes = 0
+        for chunk in chunks:
+            nbytes += _size(chunk)
+            yield chunk
+        self.add(command, time.perf_counter() - start, nbytes)
+
+    def merge(self, records: list):
+        """ Add the records of another profiler, e.g. of a worker process
+
+        Parameters
+        ----------
+        records : list
+            records returned by `rows`
+        """
+        with self._lock:
+            for rec in records:
+                stat = self.stats[(rec['method'], rec['command'])]
+                stat[0] += rec['calls']
+                stat[1] += rec['seconds']
+                stat[2] += rec['bytes']
+
+    def clear(self):
+        """ Drop all records
+        """
+        with self._lock:
+            self.stats.clear()
+
+    def rows(self) -> list:
+        """ Get the records, most expensive first
+
+        Returns
+        -------
+        list
+            [{method, command, calls, seconds, bytes}]
+        """
+        with self._lock:
+            items = sorted(self.stats.items(), key=lambda x: -x[1][1])
+        return [{'method': method, 'command': command, 'calls': calls,
+                 'seconds': seconds, 'bytes': nbytes}
+                for (method, command), (calls, seconds, nbytes) in items]
@@ -12,10 +12,11 @@ from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, confusion_matrix, f1_score
 from imblearn.over_sampling import SMOTE
+from defi_assessment.schema import OVERVIEW_SCHEMA, read_dataset
 
 
 def get_dataset(src: Path):
-    df = pd.read_csv(src)
+    df = read_dataset(src, OVERVIEW_SCHEMA)
     df.drop(['time', 'plat'], axis=1, inplace=True)
     train, test = train_test_split(df, test_size=0.3)
     print(f'Status of train set:\n{train["buggy"].value_counts()}')
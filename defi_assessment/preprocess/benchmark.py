@@ -0,0 +1,109 @@
+"""Compare the diff cleaners of `get_clean_log` on generated commits.
+
+    python -m defi_assessment.preprocess.benchmark --files 200
+
+Diffs with many files, some of them ignored, are cleaned by the multi-pass
+cleaner of earlier versions and by the single-pass `split_diff`. The texts
+are checked to be equal.
+"""
+import random
+import time
+import click
+from .contract import (INGNORE_FILES, del_multiple_files, clean_lines,
+                       split_changes, get_valid_log_content, rm_special_words)
+
+__all__ = ['make_diff', 'legacy_valid_log_content', 'compare_cleaners']
+
+EXTS = ['.sol', '.js', '.py', '.txt'] + INGNORE_FILES
+
+
+def make_diff(rng: random.Random, files: int, lines: int) -> str:
+    """ Generate the diff of a commit
+
+    Parameters
+    ----------
+    rng : random.Random
+        random generator
+    files : int
+        number of changed files
+    lines : int
+        number of changed lines of a file at most
+
+    Returns
+    -------
+    str
+        diff in the format of `GitCommit.get_diff`
+    """
+    out = []
+    for i in range(files):
+        name = f'src/f{i}{rng.choice(EXTS)}'
+        out.append(f'diff --git a/{name} b/{name}')
+        out.append(f'index {rng.getrandbits(28):07x}..'
+                   f'{rng.getrandbits(28):07x} 100644')
+        out.append(f'--- a/{name}')
+        out.append(f'+++ b/{name}')
+        for _ in range(rng.randint(1, 4)):
+            n = rng.randint(1, lines)
+            out.append(f'@@ -{rng.randint(1, 999)},{n} '
+                       f'+{rng.randint(1, 999)},{n} @@')
+            for _ in range(n):
+                sign = rng.choice('+- ')
+                out.append(f'{sign}    uint x{rng.randint(0, 99)} = '
+                           f'"{rng.randint(0, 9999)}";')
+    return '\n'.join(out)
+
+
+def legacy_valid_log_content(lines: str, type: str = 'add') -> str:
+    """ Clean a diff with the multi-pass cleaner of earlier versions
+    """
+    for fname in INGNORE_FILES:
+        lines = del_multiple_files(fname, lines)
+    lines = clean_lines(lines)
+    d, a = split_changes(lines)
+    if type == 'del':
+        return d
+    return a
+
+
+def compare_cleaners(diffs: list) -> dict:
+    """ Time both cleaners on diffs and check that they give the same text
+
+    Parameters
+    ----------
+    diffs : list
+        diffs of commits
+
+    Returns
+    -------
+    dict
+        {cleaner name: seconds}
+    """
+    times, texts = {}, {}
+    for name, clean in [('multi-pass', legacy_valid_log_content),
+                        ('single-pass', get_valid_log_content)]:
+        start = time.perf_counter()
+        texts[name] = [rm_special_words(clean(diff)) for diff in diffs]
+        times[name] = time.perf_counter() - start
+    if texts['multi-pass'] != texts['single-pass']:
+        diff = sum(a != b for a, b in zip(*texts.values()))
+        raise RuntimeError(f'Cleaners give {diff} different texts')
+    return times
+
+
+@click.command()
+@click.option('--commits', '-n', default=20, show_default=True,
+              help='Number of generated diffs.')
+@click.option('--files', '-f', default=100, show_default=True,
+              help='Number of changed files of a diff.')
+@click.option('--lines', '-l', default=30, show_default=True,
+              help='Number of changed lines of a hunk at most.')
+@click.option('--seed', default=0, show_default=True)
+def main(commits, files, lines, seed):
+    rng = random.Random(seed)
+    diffs = [make_diff(rng, files, lines) for _ in range(commits)]
+    for name, secs in compare_cleaners(diffs).items():
+        click.echo(f'{name:>12}: {secs:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,38 @@
 import re
+import os
+import json
+import hashlib
 import pandas as pd
 from pathlib import Path
-from typing import List
+from collections import Counter, deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Sequence
 from loguru import logger
-from sklearn.feature_extraction.text import CountVectorizer
+from defi_assessment.schema import (MATRIX_SCHEMA, OVERVIEW_SCHEMA,
+                                    iter_dataset, read_dataset,
+                                    write_dataset)
 
 INGNORE_FILES = [
     '.json', '.md', '.yaml', '.yml', '.gitignore', '.log', '.pdf', 'LICENSE',
 ]
 
+# header of the changes of an ignored file. Suffixes are regexes, as in
+# `del_changes_of_file`
+IGNORED_HEADER = re.compile(
+    r'^diff --git .*(?:' + '|'.join(INGNORE_FILES) + r')$'
+)
+
+# rows of a buggy commit file read at a time
+COMMIT_CHUNK = 1000
+COMMIT_DTYPES = {'commit': str, 'msg': str, 'changes': str, 'buggy': bool}
+# word count files beside the overview, see `overview_files`
+COUNTS_DTYPES = {'plat': str, 'commit': str, 'changes_hash': str}
+# data files read at once by `read_data`
+READ_JOBS = 4
+# words as tokenized by `CountVectorizer` with its default settings
+TOKEN_PATTERN = re.compile(r'(?u)\b\w\w+\b')
+
 
 def cnt_lines(lines):
     lines = [line for line in lines.split('\n') if line]
@@ -36,32 +60,131 @@ def find_data_file(fdir: Path, suffix: str) -> list:
     return [f for f in fnames if pat.match(f.name)]
 
 
-def read_data(fnames: List[Path], type: str = 'csv') -> pd.DataFrame:
+def _read_data_file(fname: Path,
+                    type: str = 'csv',
+                    schema: dict = None) -> pd.DataFrame:
+    if type == 'json':
+        df = pd.read_json(fname, orient='table')
+    else:
+        df = read_dataset(fname, schema)
+    df['plat'] = fname.stem
+    return df
+
+
+def read_data(fnames: List[Path],
+              type: str = 'csv',
+              schema: dict = None,
+              jobs: int = READ_JOBS) -> pd.DataFrame:
     """Read all data files and concatenate them
 
+    Files are read by `jobs` threads at once, as parsing is mostly done by
+    pandas and pyarrow without holding the GIL.
+
     Parameters
     ----------
     fnames : List[Path]
         List of file names
+    type : str, optional
+        'json', or 'csv' for csv, parquet and feather files, by default
+        'csv'
+    schema : dict, optional
+        column types of csv, parquet and feather files, by default None
+    jobs : int, optional
+        number of files read at once, by default READ_JOBS
 
     Returns
     -------
     pd.DataFrame
         Over all dataframe
     """
-    if type == 'json':
-        df = pd.read_json(fnames[0], orient='table')
-    else:
-        df = pd.read_csv(fnames[0])
-    df['plat'] = fnames[0].stem
-    for fname in fnames[1:]:
-        if type == 'json':
-            sub_df = pd.read_json(fname, orient='table')
-        else:
-            sub_df = pd.read_csv(fname)
-        sub_df['plat'] = fname.stem
-        df = df.append(sub_df, ignore_index=True)
-    return df
+    if not fnames:
+        return pd.DataFrame(columns=list(schema or {}) + ['plat'])
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        dfs = list(pool.map(
+            lambda fname: _read_data_file(fname, type, schema), fnames
+        ))
+    return pd.concat(dfs, ignore_index=True)
+
+
+def iter_data(fnames: List[Path],
+              type: str = 'csv',
+              schema: dict = None,
+              chunksize: int = None) -> Iterator[pd.DataFrame]:
+    """Read data files lazily, for datasets which do not fit in memory
+
+    Parameters
+    ----------
+    fnames : List[Path]
+        List of file names
+    type : str, optional
+        'json', or 'csv' for csv, parquet and feather files, by default
+        'csv'
+    schema : dict, optional
+        column types of csv, parquet and feather files, by default None
+    chunksize : int, optional
+        number of rows of a csv, parquet or feather file read at a time,
+        by default None, which reads whole files. json files are always
+        read whole
+
+    Yields
+    ------
+    pd.DataFrame
+        rows of a file, with the file name in the `plat` column
+    """
+    for fname in fnames:
+        if chunksize is None or type == 'json':
+            yield _read_data_file(fname, type, schema)
+            continue
+        for df in iter_dataset(fname, schema, chunksize):
+            df['plat'] = fname.stem
+            yield df
+
+
+def find_commit_files(fdir: Path) -> list:
+    """Find the buggy commit file of every platform
+
+    `xxxx_buggy_commits.json` files of earlier versions are used for
+    platforms without a `xxxx_buggy_commits.jsonl.gz` file.
+
+    Parameters
+    ----------
+    fdir : Path
+        path of the root data folder
+
+    Returns
+    -------
+    list
+        list of (platform, file name)
+    """
+    files = {}
+    for suffix in ['_buggy_commits.json', '_buggy_commits.jsonl.gz']:
+        for fname in find_data_file(fdir, re.escape(suffix)):
+            files[fname.name[:-len(suffix)]] = fname
+    return sorted(files.items())
+
+
+def iter_commit_data(fname: Path,
+                     chunksize: int = COMMIT_CHUNK) -> Iterator[pd.DataFrame]:
+    """Read a buggy commit file in chunks
+
+    Parameters
+    ----------
+    fname : Path
+        buggy commit file
+    chunksize : int, optional
+        number of rows per chunk, by default COMMIT_CHUNK
+
+    Yields
+    ------
+    pd.DataFrame
+        commit, msg, changes and buggy columns
+    """
+    if fname.suffix == '.json':
+        yield pd.read_json(fname, orient='table')
+        return
+    with pd.read_json(fname, lines=True, chunksize=chunksize,
+                      dtype=COMMIT_DTYPES) as reader:
+        yield from reader
 
 
 def del_changes_of_file(fname: str, lines: str):
@@ -152,14 +275,44 @@ def split_changes(lines: str):
     return del_lines, add_lines
 
 
+def split_diff(lines: Iterable[str]) -> tuple:
+    """Split a diff into deleted and added lines in a single pass
+
+    Changes of files ending with INGNORE_FILES are dropped as their headers
+    appear. Gives the same lines as `del_multiple_files` for every ignored
+    file, then `clean_lines` and `split_changes`.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        lines of a diff, without line breaks
+
+    Returns
+    -------
+    tuple
+        (deleted lines, added lines), with their '-' and '+' signs
+    """
+    del_lines, add_lines = [], []
+    ignored = False
+    for line in lines:
+        if line.startswith('diff --git '):
+            ignored = IGNORED_HEADER.match(line) is not None
+        elif ignored:
+            continue
+        elif line.startswith('+'):
+            if not line.startswith('+++ '):
+                add_lines.append(line)
+        elif line.startswith('-'):
+            if not line.startswith('--- '):
+                del_lines.append(line)
+    return del_lines, add_lines
+
+
 def get_valid_log_content(lines: str, type: str = 'add'):
-    for fname in INGNORE_FILES:
-        lines = del_multiple_files(fname, lines)
-    lines = clean_lines(lines)
-    d, a = split_changes(lines)
+    d, a = split_diff(lines.split('\n'))
     if type == 'del':
-        return d
-    return a
+        return '\n'.join(d)
+    return '\n'.join(a)
 
 
 def rm_special_words(txt: str) -> str:
@@ -194,38 +347,370 @@ def get_clean_log(txt: str):
     return txt
 
 
-def pre_process(p: Path):
-    logger.info("Start reading matrix.csv...")
-    fnames = find_data_file(p, '_matrix.csv')
-    matrix_df = read_data(fnames)
-    matrix_df['plat'] = matrix_df['plat'].apply(
-        lambda x: re.sub(r'(_matrix$)', '', x)
-    )
-    print(matrix_df.head())
+def count_words(text: str, keywords: Sequence[str] = ()) -> list:
+    """Count the words of a cleaned text
 
-    logger.info('Start reading commits.json...')
-    fnames = find_data_file(p, 'commits.json')
-    commit_df = read_data(fnames, 'json')
-    commit_df['text'] = commit_df['changes'].apply(
-        lambda x: get_clean_log(x)
-    )
-    commit_df.drop(['msg', 'changes'], axis=1, inplace=True)
-    commit_df['plat'] = commit_df['plat'].apply(
-        lambda x: re.sub(r'(_buggy_commits$)', '', x)
-    )
-    print(commit_df.head())
+    Words are found as `CountVectorizer` does by default, so the counts
+    equal sums over its document-term matrix, without building the
+    vocabulary of all texts.
 
-    logger.info('Data pre-processing...')
-    cv = CountVectorizer()
-    cv_fit = cv.fit_transform(commit_df['text'].tolist())
-    commit_df['nw'] = cv_fit.toarray().sum(axis=1)
+    Parameters
+    ----------
+    text : str
+        text from `get_clean_log`
+    keywords : Sequence[str], optional
+        words counted one by one, by default ()
+
+    Returns
+    -------
+    list
+        number of words, number of `function` words, then the number of
+        each keyword
+    """
+    counts = Counter(TOKEN_PATTERN.findall(text.lower()))
+    return [sum(counts.values()), counts['function'],
+            *(counts[word.lower()] for word in keywords)]
 
-    idx = cv.get_feature_names_out().tolist().index('function')
-    commit_df['nfunc'] = cv_fit.toarray()[:, idx]
 
+def keyword_columns(keywords: Sequence[str]) -> list:
+    """Name the columns of keyword counts, e.g. `nrequire` for `require`
+    """
+    return [f'n{word.lower()}' for word in keywords]
+
+
+def _count_logs(changes: list, keywords: Sequence[str] = ()) -> list:
+    return [count_words(get_clean_log(x), keywords) for x in changes]
+
+
+def hash_changes(changes: str) -> str:
+    """Hash the changes of a commit, to find the commits whose changes
+    differ from those counted before
+
+    Returns
+    -------
+    str
+        sha1 hex digest
+    """
+    return hashlib.sha1(str(changes).encode('utf-8', 'surrogatepass')) \
+        .hexdigest()
+
+
+def _read_commits(p: Path,
+                  jobs: int,
+                  task,
+                  columns: list,
+                  plats: Iterable[str] = None,
+                  known: dict = None) -> pd.DataFrame:
+    """Read the buggy commits of all platforms, replacing their message and
+    changes by the columns `task` makes of a list of changes, and the
+    `changes_hash` column of `hash_changes`
+
+    The changes of commits in `known`, {(plat, commit): (hash, row)}, with
+    the same hash are not given to `task`, and their row is used instead.
+    """
+    known = known or {}
+
+    def chunks():
+        for plat, fname in find_commit_files(p):
+            if plats is None or plat in plats:
+                for chunk in iter_commit_data(fname):
+                    yield plat, chunk
+
+    def split(plat, chunk):
+        chunk['changes_hash'] = [hash_changes(x) for x in chunk['changes']]
+        old = [known.get((plat, c), (None, None))
+               for c in chunk['commit']]
+        old = [row if digest == h else None
+               for (digest, row), h in zip(old, chunk['changes_hash'])]
+        changes = [x for x, row in zip(chunk['changes'], old) if row is None]
+        return old, changes
+
+    def frame(plat, chunk, old, rows):
+        rows = iter(rows)
+        rows = [row if row is not None else next(rows) for row in old]
+        chunk = chunk.drop(['msg', 'changes'], axis=1)
+        chunk[columns] = pd.DataFrame(rows, columns=columns,
+                                      index=chunk.index)
+        chunk['plat'] = plat
+        return chunk
+
+    frames = []
+    if jobs <= 1:
+        for plat, chunk in chunks():
+            old, changes = split(plat, chunk)
+            frames.append(frame(plat, chunk, old, task(changes)))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # a few chunks per process are read ahead, not all of them
+            pending = deque()
+            for plat, chunk in chunks():
+                old, changes = split(plat, chunk)
+                pending.append((plat, chunk, old, pool.submit(task, changes)))
+                chunk['changes'] = None
+                if len(pending) > 2 * jobs:
+                    plat, chunk, old, future = pending.popleft()
+                    frames.append(frame(plat, chunk, old, future.result()))
+            for plat, chunk, old, future in pending:
+                frames.append(frame(plat, chunk, old, future.result()))
+    if not frames:
+        return pd.DataFrame(columns=['commit', 'buggy', 'changes_hash',
+                                     *columns, 'plat'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_commit_counts(p: Path,
+                       jobs: int = 1,
+                       keywords: Sequence[str] = (),
+                       plats: Iterable[str] = None,
+                       known: dict = None) -> pd.DataFrame:
+    """Read the buggy commits of all platforms with the word counts of
+    their changes
+
+    Changes are cleaned and counted in one pass by the same processes, so
+    neither their text nor a vocabulary is kept in memory.
+
+    Parameters
+    ----------
+    p : Path
+        path of the root data folder
+    jobs : int, optional
+        number of processes cleaning chunks at the same time, by default 1
+    keywords : Sequence[str], optional
+        words counted one by one, see `keyword_columns`, by default ()
+    plats : Iterable[str], optional
+        only read the commits of these platforms, by default None for all
+        platforms
+    known : dict, optional
+        {(plat, commit): (changes hash, counts)} of commits which are not
+        counted again if their changes have the same `hash_changes`, by
+        default None
+
+    Returns
+    -------
+    pd.DataFrame
+        commit, buggy, changes_hash, nw, nfunc, keyword counts and plat
+        columns, in the order of the files
+    """
+    columns = ['nw', 'nfunc', *keyword_columns(keywords)]
+    task = partial(_count_logs, keywords=tuple(keywords))
+    return _read_commits(p, jobs, task, columns, plats, known)
+
+
+def find_matrix_files(fdir: Path) -> dict:
+    """Find the matrix file of every platform
+
+    Parameters
+    ----------
+    fdir : Path
+        path of the root data folder
+
+    Returns
+    -------
+    dict
+        {platform: file name}
+    """
+    fnames = find_data_file(fdir, r'_matrix\.(csv|parquet|feather)')
+    return {re.sub(r'_matrix$', '', f.stem): f for f in fnames}
+
+
+def _merge_features(matrix_df: pd.DataFrame,
+                    commit_df: pd.DataFrame) -> pd.DataFrame:
     df = pd.merge(matrix_df, commit_df, on=['commit', 'plat', 'buggy'])
-    df.drop(['text'], axis=1, inplace=True)
     df.dropna(inplace=True)
+    return df
+
+
+def pre_process(p: Path,
+                jobs: int = 1,
+                keywords: Sequence[str] = (),
+                plats: Iterable[str] = None,
+                known: dict = None) -> pd.DataFrame:
+    """Join the matrix and the word counts of the commits of all platforms
+
+    Parameters
+    ----------
+    p : Path
+        path of the root data folder
+    jobs : int, optional
+        number of processes cleaning commit changes, by default 1
+    keywords : Sequence[str], optional
+        words counted one by one, see `keyword_columns`, by default ()
+    plats : Iterable[str], optional
+        only process these platforms, by default None for all platforms
+    known : dict, optional
+        {(plat, commit): (changes hash, counts)} of commits which are not
+        counted again if their changes have the same hash, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        overview of the commits, with the columns of OVERVIEW_SCHEMA and
+        keyword counts
+    """
+    return _pre_process(p, jobs, keywords, plats, known)[0]
+
+
+def _pre_process(p: Path,
+                 jobs: int = 1,
+                 keywords: Sequence[str] = (),
+                 plats: Iterable[str] = None,
+                 known: dict = None) -> tuple:
+    """(overview, word counts of all read commits), see `pre_process`
+    """
+    logger.info("Start reading matrix...")
+    fnames = [f for plat, f in find_matrix_files(p).items()
+              if plats is None or plat in plats]
+    matrix_df = read_data(fnames, schema=MATRIX_SCHEMA)
+    matrix_df['plat'] = matrix_df['plat'].str.replace(r'_matrix$', '',
+                                                      regex=True)
+    print(matrix_df.head())
+
+    logger.info('Start reading buggy commits...')
+    commit_df = read_commit_counts(p, jobs, keywords, plats, known)
+    print(commit_df.head())
+
+    logger.info('Data pre-processing...')
+    df = _merge_features(matrix_df, commit_df.drop(columns='changes_hash'))
     print(df.head())
 
-    return df
+    return df, commit_df
+
+
+def hash_file(fname: Path) -> str:
+    """Hash the content of a file
+
+    Parameters
+    ----------
+    fname : Path
+        file name
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def overview_files(target: Path) -> tuple:
+    """Get the state and word count files kept beside an overview
+
+    Parameters
+    ----------
+    target : Path
+        overview file, e.g. contract_overview.csv
+
+    Returns
+    -------
+    tuple
+        (`<name>_state.json`, `<name>_counts` in the format of `target`)
+    """
+    target = Path(target)
+    return (target.with_name(f'{target.stem}_state.json'),
+            target.with_name(f'{target.stem}_counts{target.suffix}'))
+
+
+def _input_hashes(p: Path) -> dict:
+    """{platform: {file: content hash}} of the matrix and buggy commit
+    files
+    """
+    files = {}
+    for plat, fname in find_matrix_files(p).items():
+        files.setdefault(plat, []).append(fname)
+    for plat, fname in find_commit_files(p):
+        files.setdefault(plat, []).append(fname)
+    return {plat: {f.name: hash_file(f) for f in sorted(fnames)}
+            for plat, fnames in sorted(files.items())}
+
+
+def process_overview(p: Path,
+                     target: Path,
+                     jobs: int = 1,
+                     keywords: Sequence[str] = (),
+                     force: bool = False) -> bool:
+    """Create the overview of all platforms, or update the rows of the
+    platforms whose files changed since it was written
+
+    The content hashes of the input files of each platform are kept in
+    `<name>_state.json`, and the word counts of every commit in
+    `<name>_counts`, see `overview_files`. Platforms whose files have the
+    same hashes are not read again. In the others, only the changes of the
+    commits which are new or whose changes differ from those counted, by
+    `hash_changes`, are cleaned and counted, then the rows of the platform
+    are replaced in the overview.
+
+    Parameters
+    ----------
+    p : Path
+        path of the root data folder
+    target : Path
+        overview file, in any format of `write_dataset`
+    jobs : int, optional
+        number of processes cleaning commit changes, by default 1
+    keywords : Sequence[str], optional
+        words counted one by one, see `keyword_columns`, by default ()
+    force : bool, optional
+        process all platforms and commits again, by default False
+
+    Returns
+    -------
+    bool
+        whether the overview was written
+    """
+    target = Path(target)
+    state_path, counts_path = overview_files(target)
+    keywords = list(keywords)
+    columns = ['nw', 'nfunc', *keyword_columns(keywords)]
+    hashes = _input_hashes(Path(p))
+
+    state = None
+    if not force and state_path.exists() and target.exists() \
+            and counts_path.exists():
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('keywords') != keywords:
+            logger.info('Keywords changed, processing all platforms')
+            state = None
+    old_hashes = state['files'] if state else {}
+    plats = [plat for plat in hashes if hashes[plat] != old_hashes.get(plat)]
+    gone = [plat for plat in old_hashes if plat not in hashes]
+    if state and not plats and not gone:
+        logger.info(f'{target} is up to date')
+        return False
+
+    known = None
+    if state:
+        counts = read_dataset(counts_path, COUNTS_DTYPES)
+        counts = counts[~counts['plat'].isin(gone)]
+        changed = counts['plat'].isin(plats)
+        if 'changes_hash' not in counts:
+            # written before the hashes were kept
+            counts['changes_hash'] = None
+        known = dict(zip(zip(counts['plat'][changed],
+                             counts['commit'][changed]),
+                         zip(counts['changes_hash'][changed],
+                             counts.loc[changed, columns].values.tolist())))
+        logger.info(f'Updating platforms {", ".join(plats + gone)}, '
+                    f'{len(known)} commits counted before')
+    df, commit_df = _pre_process(p, jobs, keywords, plats, known)
+    commit_df = commit_df[['plat', 'commit', 'changes_hash', *columns]]
+    if state:
+        old = read_dataset(target, OVERVIEW_SCHEMA)
+        df = pd.concat([old[~old['plat'].isin(plats + gone)], df],
+                       ignore_index=True)
+        commit_df = pd.concat([counts.loc[~changed, commit_df.columns],
+                               commit_df], ignore_index=True)
+
+    # the state is written last, so files written before an interruption
+    # are written again by the next run
+    write_dataset(commit_df, counts_path, COUNTS_DTYPES)
+    write_dataset(df, target, OVERVIEW_SCHEMA)
+    tmp = state_path.with_name(f'{state_path.name}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'keywords': keywords, 'files': hashes}, f, indent=2)
+    os.replace(tmp, state_path)
+    return True
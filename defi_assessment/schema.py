@@ -0,0 +1,295 @@
+"""Column types of the contract datasets and the files they are kept in.
+
+Datasets are CSV files by default. They can also be kept as Parquet or
+Feather files, which are typed, smaller and read without parsing text.
+These formats need the pyarrow package, e.g. `pip install .[parquet]`.
+The format of a file is told by its suffix.
+"""
+import os
+import ast
+import pandas as pd
+from pathlib import Path
+from typing import Iterator, List, Tuple, get_args, get_origin
+
+__all__ = [
+    'FORMATS', 'MATRIX_SCHEMA', 'FIX_COMMIT_SCHEMA', 'OVERVIEW_SCHEMA',
+    'dataset_path', 'find_dataset', 'read_dataset', 'iter_dataset',
+    'write_dataset', 'convert_dataset',
+]
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# `List[...]` columns hold python lists, written as their repr in csv files
+MATRIX_SCHEMA = {
+    'commit': str,
+    'la': 'int64',
+    'ld': 'int64',
+    'ns': 'int64',
+    'nd': 'int64',
+    'nf': 'int64',
+    'nuc': 'int64',
+    'ndev': 'int64',
+    'inter': 'float64',
+    'ent': 'float64',
+    'exp': 'int64',
+    'rexp': 'float64',
+    'sexp': 'int64',
+    'pod': 'float64',
+    'fix': bool,
+    'buggy': bool,
+    'time': 'float64',
+}
+FIX_COMMIT_SCHEMA = {
+    'fix_commit': str,
+    'fname': str,
+    # [[(-start, n_lines), (+start, n_lines)]] of every hunk
+    'changed_lines': List[List[Tuple[str, str]]],
+    'bug_commits': List[str],
+}
+OVERVIEW_SCHEMA = {
+    **MATRIX_SCHEMA,
+    'plat': str,
+    'nw': 'int64',
+    'nfunc': 'int64',
+}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError('Parquet and Feather datasets need the pyarrow '
+                          'package: pip install pyarrow') from e
+    return pyarrow
+
+
+def _is_list(dtype) -> bool:
+    return dtype is list or get_origin(dtype) is list
+
+
+def _restore(value, dtype):
+    """ Turn the lists read from Parquet or Feather into the sequences of a
+    type, e.g. tuples for `Tuple[str, str]`
+    """
+    origin = get_origin(dtype)
+    if value is None or origin not in (list, tuple):
+        return value
+    args = get_args(dtype)
+    if origin is tuple and args[-1] is not Ellipsis:
+        return tuple(_restore(v, t) for v, t in zip(value, args))
+    return origin(_restore(v, args[0]) for v in value)
+
+
+def _cast(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """ Cast columns to their types, except the ones with missing values
+    """
+    for col, dtype in schema.items():
+        if col in df and not _is_list(dtype) and not df[col].isna().any():
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def _parse_lists(df: pd.DataFrame, lists: dict) -> pd.DataFrame:
+    for col in lists:
+        if col in df:
+            df[col] = [ast.literal_eval(x) if isinstance(x, str) else x
+                       for x in df[col]]
+    return df
+
+
+def _arrow_frame(table, lists: dict) -> pd.DataFrame:
+    pa = _pyarrow()
+    df = table.to_pandas()
+    for col, dtype in lists.items():
+        if col in table.column_names and pa.types.is_list(
+                table.schema.field(col).type):
+            df[col] = [_restore(x, dtype)
+                       for x in table.column(col).to_pylist()]
+    return df
+
+
+def dataset_path(path: Path, fmt: str) -> Path:
+    """ Get the file of a dataset in a format
+
+    Parameters
+    ----------
+    path : Path
+        file of the dataset in any format
+    fmt : str
+        'csv', 'parquet' or 'feather'
+
+    Returns
+    -------
+    Path
+        `path` with the suffix of the format
+    """
+    return Path(path).with_suffix(FORMATS[fmt])
+
+
+def find_dataset(path: Path) -> Path:
+    """ Find the file of a dataset which may be kept in another format
+
+    Parameters
+    ----------
+    path : Path
+        file of the dataset
+
+    Returns
+    -------
+    Path
+        `path` if it exists, else an existing file with the same name in
+        another format, else `path`
+    """
+    path = Path(path)
+    if path.exists():
+        return path
+    for suffix in FORMATS.values():
+        other = path.with_suffix(suffix)
+        if other.exists():
+            return other
+    return path
+
+
+def read_dataset(path: Path,
+                 schema: dict = None,
+                 columns: list = None) -> pd.DataFrame:
+    """ Read a dataset in any format
+
+    Parameters
+    ----------
+    path : Path
+        file of the dataset. A file with the same name in another format
+        is read if it does not exist
+    schema : dict, optional
+        {column: type}, by default None, which infers types
+    columns : list, optional
+        only read these columns, by default None for all columns
+
+    Returns
+    -------
+    pd.DataFrame
+        dataset with the columns cast to their types
+    """
+    path = find_dataset(path)
+    schema = schema or {}
+    lists = {col: dtype for col, dtype in schema.items()
+             if _is_list(dtype)}
+    if path.suffix == '.csv':
+        dtype = {col: str for col, t in schema.items() if t is str}
+        df = pd.read_csv(path, dtype=dtype, usecols=columns,
+                         float_precision='round_trip')
+        return _cast(_parse_lists(df, lists), schema)
+
+    _pyarrow()
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns)
+    else:
+        import pyarrow.feather as feather
+        table = feather.read_table(path, columns=columns)
+    return _cast(_arrow_frame(table, lists), schema)
+
+
+def iter_dataset(path: Path,
+                 schema: dict = None,
+                 chunksize: int = 100000,
+                 columns: list = None) -> Iterator[pd.DataFrame]:
+    """ Read a dataset in any format in chunks of rows
+
+    Parameters
+    ----------
+    path : Path
+        file of the dataset, see `read_dataset`
+    schema : dict, optional
+        {column: type}, by default None, which infers types
+    chunksize : int, optional
+        number of rows per chunk, by default 100000
+    columns : list, optional
+        only read these columns, by default None for all columns
+
+    Yields
+    ------
+    pd.DataFrame
+        rows of the dataset, with the columns cast to their types
+    """
+    path = find_dataset(path)
+    schema = schema or {}
+    lists = {col: dtype for col, dtype in schema.items()
+             if _is_list(dtype)}
+    if path.suffix == '.csv':
+        dtype = {col: str for col, t in schema.items() if t is str}
+        with pd.read_csv(path, dtype=dtype, usecols=columns,
+                         float_precision='round_trip',
+                         chunksize=chunksize) as reader:
+            for df in reader:
+                yield _cast(_parse_lists(df, lists), schema)
+        return
+
+    pa = _pyarrow()
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize,
+                                                    columns=columns)
+        tables = (pa.Table.from_batches([batch]) for batch in batches)
+    else:
+        import pyarrow.feather as feather
+        # slices of a memory mapped file are not read before they are used
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        tables = (table.slice(i, chunksize)
+                  for i in range(0, table.num_rows, chunksize))
+    for chunk in tables:
+        yield _cast(_arrow_frame(chunk, lists), schema)
+
+
+def write_dataset(df: pd.DataFrame, path: Path, schema: dict = None):
+    """ Write a dataset in the format told by the suffix of its file
+
+    The file is replaced at once, so readers never see a partial dataset.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataset
+    path : Path
+        `.csv`, `.parquet` or `.feather` file
+    schema : dict, optional
+        {column: type}, by default None, which keeps the types of `df`
+    """
+    path = Path(path)
+    df = _cast(df.copy(), schema or {})
+    tmp = path.with_name(f'{path.name}.tmp')
+    if path.suffix == '.csv':
+        df.to_csv(tmp, index=False)
+    elif path.suffix == '.parquet':
+        _pyarrow()
+        df.to_parquet(tmp, index=False)
+    elif path.suffix == '.feather':
+        _pyarrow()
+        df.reset_index(drop=True).to_feather(tmp)
+    else:
+        raise ValueError(f'Unknown dataset format: {path}')
+    os.replace(tmp, path)
+
+
+def convert_dataset(path: Path, schema: dict = None) -> bool:
+    """ Convert a dataset kept in another format into the format of `path`
+
+    Parameters
+    ----------
+    path : Path
+        file of the dataset in the wanted format
+    schema : dict, optional
+        {column: type}, by default None
+
+    Returns
+    -------
+    bool
+        whether a file was converted
+    """
+    path = Path(path)
+    src = find_dataset(path)
+    if src == path or not src.exists():
+        return False
+    write_dataset(read_dataset(src, schema), path, schema)
+    src.unlink()
+    return True
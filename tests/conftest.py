@@ -0,0 +1,56 @@
+import subprocess
+import pytest
+
+
+def _data(content: str) -> str:
+    return f'data {len(content.encode("utf-8"))}\n{content}\n'
+
+
+def fast_import(path, commits: list, refs: dict = None) -> str:
+    """ Write a bare git repo with `git fast-import`
+
+    Parameters
+    ----------
+    path : Path
+        directory of the new repo
+    commits : list
+        [(author, {path: content, None to delete})], each commit a child
+        of the one before, on branch main
+    refs : dict, optional
+        {ref name: index of the commit it points to}, by default None
+
+    Returns
+    -------
+    str
+        path of the repo
+    """
+    stream = []
+    for i, (author, files) in enumerate(commits):
+        t = 1600000000 + 3600 * i
+        stream.append(f'commit refs/heads/main\nmark :{i + 1}\n'
+                      f'author {author} {t} +0000\n'
+                      f'committer {author} {t} +0000\n')
+        stream.append(_data(f'commit {i}'))
+        if i:
+            stream.append(f'from :{i}\n')
+        for name, content in files.items():
+            if content is None:
+                stream.append(f'D {name}\n')
+            else:
+                stream.append(f'M 100644 inline {name}\n{_data(content)}')
+    for ref, i in (refs or {}).items():
+        stream.append(f'reset {ref}\nfrom :{i + 1}\n\n')
+    subprocess.run(['git', 'init', '--quiet', '--bare', str(path)],
+                   check=True)
+    subprocess.run(['git', 'fast-import', '--quiet'], cwd=path, check=True,
+                   input=''.join(stream).encode('utf-8'))
+    subprocess.run(['git', 'symbolic-ref', 'HEAD', 'refs/heads/main'],
+                   cwd=path, check=True)
+    return str(path)
+
+
+@pytest.fixture
+def make_repo(tmp_path):
+    def make(commits, refs=None):
+        return fast_import(tmp_path / 'repo.git', commits, refs)
+    return make
@@ -0,0 +1,90 @@
+import pytest
+from defi_assessment.git_tool.gitcmd import GitCommit, DiffLimits
+from defi_assessment.git_tool.parser import patch_paths
+
+AUTHOR = 'Alice <alice@example.com>'
+BACKENDS = ['subprocess', 'pygit2']
+
+
+def _backend(name):
+    if name == 'pygit2':
+        pytest.importorskip('pygit2')
+    return name
+
+
+@pytest.fixture
+def vendored(make_repo):
+    """ A commit changing a contract and vendoring 6000 files, whose paths
+    are far longer together than a command line may be
+    """
+    files = {'contracts/Pool.sol': 'uint x = 2;\n'}
+    for i in range(3000):
+        pkg = f'node_modules/vendored-package-{i:04d}/dist'
+        files[f'{pkg}/package.json'] = '{"version": "1.0.0"}\n'
+        files[f'{pkg}/index.js'] = 'let x = 1;\n' * 10
+    return make_repo([(AUTHOR, {'contracts/Pool.sol': 'uint x = 1;\n'}),
+                      (AUTHOR, files)])
+
+
+def _changed(gc, limits):
+    commit = gc.get_commits()[0]
+    return [patch_paths(patch.split('\n', 1)[0])[1]
+            for patch in gc.iter_diff(commit, limits)]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_diff_exclude_of_large_commit(vendored, backend):
+    with GitCommit(vendored, indexed=False, path=vendored,
+                   backend=_backend(backend)) as gc:
+        paths = _changed(gc, DiffLimits(exclude=('*.json',)))
+    assert len(paths) == 3001
+    assert not any(p.endswith('.json') for p in paths)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_max_diff_lines_of_large_commit(vendored, backend):
+    with GitCommit(vendored, indexed=False, path=vendored,
+                   backend=_backend(backend)) as gc:
+        paths = _changed(gc, DiffLimits(max_lines=5))
+    assert len(paths) == 3001
+    assert not any(p.endswith('.js') for p in paths)
+
+
+def test_patch_paths():
+    assert patch_paths('diff --git a/a b/c b/a b/c\n') == ('a b/c', 'a b/c')
+    assert patch_paths('diff --git a/x.sol b/y.sol') == ('x.sol', 'y.sol')
+    assert patch_paths('diff --git "a/\\303\\251" "b/\\303\\251"') == \
+        ('é', 'é')
+
+
+def test_commits_since_many_refs(make_repo):
+    commits = [(AUTHOR, {'a.sol': f'uint x = {i};\n'}) for i in range(3)]
+    refs = {f'refs/tags/v{i:04d}': 0 for i in range(4001)}
+    path = make_repo(commits, refs)
+    with GitCommit(path, indexed=False, path=path) as gc:
+        tips = list(gc.get_tips().values())
+        assert len(tips) == 4002
+        tips.remove(gc.get_tips()['refs/heads/main'])
+        # a tip gone from the repo, e.g. after a force push
+        tips.append('1' * 40)
+        new = gc.get_commits_since(tips)
+        assert new == gc.get_commits()[:2]
+
+
+def test_author_exp_matches_git(make_repo):
+    # authors are basic regular expressions for git: `[bot]` is a class
+    # of one letter and `.` any character
+    authors = ['dependabot[bot] <49699333+dependabot[bot]@users.noreply>',
+               'dependabotb <b@example.com>', 'J. Doe <j@example.com>',
+               'JX Doe <jx@example.com>', 'C++ Dev (x) <c@example.com>']
+    commits = [(authors[i % len(authors)], {f'f{i % 3}.sol': f'x{i}\n'})
+               for i in range(15)]
+    path = make_repo(commits)
+    with GitCommit(path, indexed=False, path=path) as gc:
+        children = gc.get_commits()[:-1]
+        expected = {c: gc.get_author_exp(c) for c in children}
+    with GitCommit(path, path=path) as gc:
+        got = {c: gc.get_author_exp(c) for c in children}
+        bot = [c for c in got if gc.get_author(c) == 'dependabot[bot]']
+    assert got == expected
+    assert len(got[bot[0]]) == 2
@@ -0,0 +1,28 @@
+import pandas as pd
+import pytest
+from defi_assessment.schema import (FIX_COMMIT_SCHEMA, convert_dataset,
+                                    dataset_path, read_dataset)
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'feather'])
+def test_fix_commits_round_trip(tmp_path, fmt):
+    pytest.importorskip('pyarrow')
+    csv = tmp_path / 'A_fix_commits.csv'
+    # rows as written by the blame stage
+    rows = [['1a2b3c4d', 'contracts/Pool.sol',
+             [[('-62', '0'), ('+63', '3')], [('-70', '2'), ('+73', '1')]],
+             ['0badc0de', '5eed5eed']],
+            ['1a2b3c4d', 'README.md', [[('-1', '1'), ('+1', '1')]], []]]
+    pd.DataFrame(rows, columns=list(FIX_COMMIT_SCHEMA)).to_csv(csv,
+                                                               index=False)
+    text = csv.read_text()
+    expected = read_dataset(csv, FIX_COMMIT_SCHEMA)
+
+    assert convert_dataset(dataset_path(csv, fmt), FIX_COMMIT_SCHEMA)
+    df = read_dataset(dataset_path(csv, fmt), FIX_COMMIT_SCHEMA)
+    assert df['changed_lines'].tolist() == expected['changed_lines'].tolist()
+    assert isinstance(df['changed_lines'][0][0][0], tuple)
+    assert isinstance(df['bug_commits'][0], list)
+
+    assert convert_dataset(csv, FIX_COMMIT_SCHEMA)
+    assert csv.read_text() == text